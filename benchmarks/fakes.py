@@ -0,0 +1,151 @@
+"""
+Offline stand-ins for Discord, Wikipedia, Reddit, and Google Maps, so cogs can be driven without any network.
+"""
+
+import json
+from types import SimpleNamespace
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from helpers import fetch, outbox, ratelimit, wiki
+
+# Benchmarks measure the bot, not the quota, so no bucket ever runs dry
+UNLIMITED = {service: (1e9, 1e9, 1e9, 1e9) for service in ratelimit.SERVICES}
+
+
+class FakeBot:
+    """
+    Records what cogs send instead of sending it.
+    """
+
+    def __init__(self):
+        self.sent = []  # (destination, content, embed) ; destination is NoneType for say()
+        self.calls = 0  # Messages sent, i.e. Discord API calls a real bot would have made
+
+    async def say(self, content=None, *args, embed=None, **kwargs):
+        self.sent.append((None, content, embed))
+        self.calls += 1
+
+    async def send_message(self, destination, content=None, *args, embed=None, **kwargs):
+        self.sent.append((destination, content, embed))
+        self.calls += 1
+
+
+def make_context(server="1", channel="10", author="100"):
+    """
+    :param server: Str or NoneType ; NoneType for a direct message
+    :param channel: Str
+    :param author: Str
+    :return: Object with the parts of commands.Context that cogs use
+    """
+
+    message = SimpleNamespace(server=SimpleNamespace(id=server) if server else None,
+                              channel=SimpleNamespace(id=channel), author=SimpleNamespace(id=author))
+    return SimpleNamespace(message=message, command=None)
+
+
+class FixtureServer:
+    """
+    Answers fetch requests from benchmarks.fixtures instead of the network.
+    """
+
+    def __init__(self, fixtures):
+        """
+        :param fixtures: benchmarks.fixtures.Fixtures
+        """
+
+        self._fixtures = fixtures
+        self.requests = 0
+
+    async def get(self, url, headers):
+        """
+        Drop-in for fetch._get.
+        :param url: Str
+        :param headers: Dict or NoneType
+        :return: fetch.Response
+        """
+
+        self.requests += 1
+        if url.startswith(wiki.API_ROOT):
+            titles = parse_qs(urlsplit(url).query)["titles"][0].split("|")
+            pages = [{"title": title, "lastrevid": self._fixtures.revision(title)} for title in titles]
+            return fetch.Response(200, {}, json.dumps({"query": {"pages": pages}}), url)
+
+        title = unquote(url[len(wiki.WIKI_ROOT):]).replace("_", " ")
+        html = self._fixtures.page(title)
+        if html is None:
+            return fetch.Response(404, {}, "", url)
+        return fetch.Response(200, {"ETag": '"{rev}"'.format(rev=self._fixtures.revision(title))}, html, url)
+
+
+def install(fixtures):
+    """
+    Routes every fetch to the fixtures and lifts rate limits, Discord's included for outboxes made afterwards.
+    :param fixtures: benchmarks.fixtures.Fixtures
+    :return: FixtureServer
+    """
+
+    server = FixtureServer(fixtures)
+    fetch._get = server.get
+    ratelimit.limiter = ratelimit.Limiter(UNLIMITED)
+    outbox.LIMITS = {scope: (1e9, 1e9) for scope in outbox.LIMITS}
+    return server
+
+
+class FakeReddit:
+    """
+    Enough of praw.Reddit for the Website cog.
+    """
+
+    def __init__(self, posts=50):
+        self._posts = posts
+        self.requests = 0
+
+    def subreddit(self, name):
+        reddit = self
+
+        class Subreddit:
+            @staticmethod
+            def hot(limit):
+                reddit.requests += 1
+                return [SimpleNamespace(title="{name} post {i}".format(name=name, i=i),
+                                        url="https://reddit.com/r/{name}/{i}".format(name=name, i=i))
+                        for i in range(min(limit, reddit._posts))]
+
+        return Subreddit()
+
+
+class FakeMaps:
+    """
+    Enough of googlemaps.Client for the GoogleMaps cog, with made up but consistent answers.
+    """
+
+    def __init__(self):
+        self.requests = 0
+
+    @staticmethod
+    def _coordinates(address):
+        h = sum(ord(c) * (i + 1) for i, c in enumerate(address.lower()))
+        return {"lat": (h % 18000) / 100 - 90, "lng": (h // 7 % 36000) / 100 - 180}
+
+    def geocode(self, address):
+        self.requests += 1
+        if address.lower().startswith("nowhere"):
+            return []
+        return [{"geometry": {"location": self._coordinates(address)},
+                 "formatted_address": address.title() + ", Canada"}]
+
+    def distance_matrix(self, origins, destinations, units="metric", mode="driving"):
+        self.requests += 1
+        elements = []
+        for lat, lng in destinations:
+            (o_lat, o_lng), = origins
+            km = abs(lat - o_lat) * 111 + abs(lng - o_lng) * 80
+            minutes = int(km / (80 if mode == "driving" else 5) * 60) + 1
+            elements.append({"status": "OK", "distance": {"text": "{:.1f} km".format(km)},
+                             "duration": {"text": "{} mins".format(minutes)}})
+        return {"rows": [{"elements": elements}]}
+
+    def places(self, query, location):
+        self.requests += 1
+        return {"results": [{"name": "{q} {i}".format(q=query, i=i), "formatted_address": "{i} Main St, Town".format(i=i),
+                             "rating": 3 + i % 3, "opening_hours": {"open_now": i % 4 != 0}} for i in range(20)]}
@@ -0,0 +1,254 @@
+"""
+Wikipedia pages for benchmarks, so they run without going online and give the same input on every commit.
+
+Pages recorded with benchmarks/record.py are used when present. Anything not recorded is generated from a fixed
+seed, laid out like Wikipedia's own markup: a "wikitable" list page per hull type, and ship articles with an
+infobox, cited lead paragraphs, and sections.
+"""
+
+import hashlib
+import json
+import os
+import random
+import zlib
+from html import escape
+from urllib.parse import quote, unquote
+
+RECORDED_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+REVISIONS_FILE = "revisions.json"
+DEFAULT_SHIPS_PER_LIST = 300
+DEFAULT_SEED = 1939
+
+_COUNTRIES = ["United States Navy", "Kriegsmarine", "Regia Marina", "Imperial Japanese Navy", "French Navy",
+              "Royal Navy", "Soviet Navy", "Marinha do Brasil", "Armada de Chile", "Armada Española",
+              "Hellenic Navy", "Marynarka Wojenna", "Royal Netherlands Navy", "Türk Deniz Kuvvetleri"]
+_COUNTRY_WEIGHTS = [6, 3, 3, 5, 3, 6, 1, 1, 1, 1, 1, 1, 1, 1]
+_SYLLABLES = ["ya", "ma", "to", "ri", "che", "lieu", "nel", "son", "bis", "marck", "ise", "hyu", "ga", "kon",
+              "go", "du", "ker", "que", "vit", "to", "rio", "ve", "ne", "to", "ro", "ma", "wa", "shing", "ton",
+              "é", "ña", "ü", "ła"]
+_FATES = ["sunk {date}", "scuttled {date}", "scrapped {year}", "decommissioned {date}", "museum ship",
+          "sunk by aircraft {date}", "transferred {year}", "constructive total loss {date}"]
+_MONTHS = ["january", "february", "march", "april", "may", "june", "july", "august", "september", "october",
+           "november", "december"]
+_WORDS = ("the ship was laid down at the naval yard and launched after a long construction period during which "
+          "her design was revised several times to account for treaty limits armour schemes and new "
+          "anti aircraft weapons before she joined the fleet and served in the war").split()
+
+
+def page_file_name(title):
+    """
+    :param title: Str
+    :return: Str ; file name of a recorded page, safe on every platform
+    """
+    return quote(title.replace(" ", "_"), safe="") + ".html"
+
+
+def _word_name(rng, syllables):
+    return "".join(rng.choice(_SYLLABLES) for _ in range(syllables)).capitalize()
+
+
+def _date(rng, low, high):
+    return "{day} {month} {year}".format(day=rng.randint(1, 28), month=rng.choice(_MONTHS).capitalize(),
+                                         year=rng.randint(low, high))
+
+
+def _sentences(rng, count):
+    return " ".join(" ".join(rng.choice(_WORDS) for _ in range(rng.randint(12, 24))).capitalize() + "."
+                    for _ in range(count))
+
+
+def _cited(rng, text, references):
+    """
+    :return: Str ; text as HTML, with citation markers after some sentences, like Wikipedia's
+    """
+
+    parts = []
+    for sentence in text.split(". "):
+        parts.append(escape(sentence))
+        if rng.random() < 0.4:
+            parts.append('<sup id="cite_ref-{n}" class="reference"><a href="#cite_note-{n}">[{n}]</a></sup>'.format(
+                n=rng.randint(1, references)))
+    return ". ".join(parts)
+
+
+def _padding(rng, size):
+    """
+    :param size: Int ; rough length in characters
+    :return: Str ; navigation chrome and reference lists that parsers have to wade through on real pages
+    """
+
+    chunks = []
+    length = 0
+    while length < size:
+        chunk = ('<div class="navbox"><table class="nowraplinks"><tr><th scope="row" class="navbox-group">{g}</th>'
+                 '<td class="navbox-list"><ul>{items}</ul></td></tr></table></div>').format(
+            g=_word_name(rng, 3), items="".join('<li><a href="/wiki/{w}" title="{w}">{w}</a></li>'.format(
+                w=_word_name(rng, 2)) for _ in range(20)))
+        chunks.append(chunk)
+        length += len(chunk)
+    return "".join(chunks)
+
+
+class Fixtures:
+    """
+    Every page benchmarks can fetch, by title.
+    """
+
+    def __init__(self, ships_per_list=DEFAULT_SHIPS_PER_LIST, seed=DEFAULT_SEED, recorded_dir=RECORDED_DIR):
+        """
+        :param ships_per_list: Int ; rows per generated list page
+        :param seed: Int
+        :param recorded_dir: Str ; recorded pages are served instead of generated ones when present
+        """
+
+        self.ships_per_list = ships_per_list
+        self.seed = seed
+        self._recorded = {}
+        self._revisions = {}
+        self._generated = {}
+        if os.path.isdir(recorded_dir):
+            for file_name in os.listdir(recorded_dir):
+                path = os.path.join(recorded_dir, file_name)
+                if file_name == REVISIONS_FILE:
+                    with open(path, encoding="utf-8") as file:
+                        self._revisions = json.load(file)
+                elif file_name.endswith(".html"):
+                    with open(path, encoding="utf-8") as file:
+                        self._recorded[unquote(file_name[:-len(".html")]).replace("_", " ")] = file.read()
+
+    @property
+    def recorded(self):
+        """
+        :return: Int ; how many pages are recorded rather than generated
+        """
+        return len(self._recorded)
+
+    def page(self, title):
+        """
+        :param title: Str
+        :return: Str ; HTML, or NoneType if the page doesn't exist
+        """
+
+        if title in self._recorded:
+            return self._recorded[title]
+        if title not in self._generated:
+            if title.startswith("List of ") and title.endswith(" of World War II"):
+                html = self._list_page(title[len("List of "):-len(" of World War II")])
+            else:
+                html = self._article(title)
+            self._generated[title] = html
+        return self._generated[title]
+
+    def revision(self, title):
+        """
+        :param title: Str
+        :return: Int
+        """
+        return self._revisions.get(title, zlib.crc32(title.encode("utf-8")))
+
+    def digest(self, titles):
+        """
+        Identifies the input a run was given, so results are only compared when it matches.
+        :param titles: Iterable of Str ; list pages
+        :return: Str
+        """
+
+        h = hashlib.sha1()
+        for title in sorted(titles):
+            h.update(self.page(title).encode("utf-8"))
+        return h.hexdigest()[:12]
+
+    def _list_page(self, _type):
+        """
+        :param _type: Str ; e.g. "battleships"
+        :return: Str
+        """
+
+        rng = random.Random("{seed}:{type}".format(seed=self.seed, type=_type))
+        rows = []
+        for i in range(self.ships_per_list):
+            country = rng.choices(_COUNTRIES, _COUNTRY_WEIGHTS)[0]
+            name = "{prefix} {word}".format(prefix=rng.choice(["", "HMS", "USS", "SMS", "HNLMS"]),
+                                            word=_word_name(rng, rng.randint(2, 4))).strip()
+            if rng.random() < 0.02 and rows:
+                name = "Duplicate {i}".format(i=i // 2)  # Some ships appear under several names
+            _class = _word_name(rng, rng.randint(2, 3))
+            if rng.random() < 0.2:
+                _class += " ({sub} subclass)".format(sub=_word_name(rng, 2))
+            elif rng.random() < 0.05:
+                _class += " = {alias}".format(alias=_word_name(rng, 2))
+
+            # Real lists link most ships, red-link a few, and point some at sections of class articles
+            article = "{country} {type} {name}".format(country=country.split()[0], type=_type[:-1], name=name)
+            roll = rng.random()
+            if roll < 0.85:
+                href = "/wiki/" + quote(article.replace(" ", "_"))
+            elif roll < 0.93:
+                href = "/w/index.php?title={t}&action=edit&redlink=1".format(t=quote(article.replace(" ", "_")))
+            else:
+                href = "/wiki/{c}-class_{t}#{n}".format(c=quote(_class.split(" (")[0]), t=_type[:-1], n=quote(name))
+
+            year = rng.randint(1912, 1945)
+            fate = rng.choice(_FATES).format(date=_date(rng, year, 1946).lower(), year=rng.randint(1946, 1975))
+            rows.append(
+                '<tr>'
+                '<td><a href="{href}" title="{article}"><i>{name}</i></a></td>'
+                '<td><span class="flagicon"><img alt="" src="//upload.wikimedia.org/flag.svg" width="23" '
+                'height="15" class="thumbborder" />&nbsp;</span><a href="/wiki/{country_link}" '
+                'title="{country}">{country}</a></td>'
+                '<td><a href="/wiki/{class_link}-class_{type}" title="{class_plain}-class {type}">{_class}</a></td>'
+                '<td>{type}</td>'
+                '<td data-sort-value="{tons}">{tons_text}</td>'
+                '<td data-sort-value="{year}">{commissioned}</td>'
+                '<td>{fate}</td>'
+                '</tr>'.format(href=escape(href), article=escape(article), name=escape(name),
+                               country=escape(country), country_link=quote(country.replace(" ", "_")),
+                               class_link=quote(_class.split(" (")[0]), class_plain=escape(_class.split(" (")[0]),
+                               _class=escape(_class), type=_type[:-1], tons=rng.randint(8000, 72000),
+                               tons_text="{:,}".format(rng.randint(8000, 72000)), year=year,
+                               commissioned=_date(rng, year, year), fate=escape(fate)))
+            if rng.random() < 0.03:
+                rows.append('<tr><td colspan="7">Incomplete entry</td></tr>')  # Skipped by scrappers
+
+        table = ('<table class="wikitable sortable"><tbody><tr><th>Ship</th><th>Operator</th><th>Class</th>'
+                 '<th>Type</th><th>Displacement (tons)</th><th>First commissioned</th><th>Fate</th></tr>'
+                 '{rows}</tbody></table>').format(rows="".join(rows))
+        return self._wrap("List of {type} of World War II".format(type=_type),
+                          "<p>This is a list of {type} of World War II.</p>".format(type=_type) + table
+                          + _padding(rng, 40000))
+
+    def _article(self, title):
+        """
+        :param title: Str
+        :return: Str
+        """
+
+        rng = random.Random("{seed}:{title}".format(seed=self.seed, title=title))
+        references = rng.randint(20, 120)
+        image = ('<tr><td colspan="2" class="infobox-image"><a href="/wiki/File:{f}.jpg" class="image">'
+                 '<img alt="{title} at sea" src="//upload.wikimedia.org/wikipedia/commons/thumb/a/ab/{f}.jpg/'
+                 '300px-{f}.jpg" width="300" height="200" /></a></td></tr>').format(
+            f=quote(title.replace(" ", "_")), title=escape(title)) if rng.random() < 0.9 else ""
+        infobox = ('<table class="infobox">{image}{rows}</table>').format(
+            image=image, rows="".join('<tr><th>{k}</th><td>{v}</td></tr>'.format(
+                k=_word_name(rng, 2), v=_sentences(rng, 1)) for _ in range(rng.randint(15, 30))))
+        lead = "".join("<p>{text}</p>".format(text=_cited(rng, _sentences(rng, rng.randint(2, 6)), references))
+                       for _ in range(rng.randint(1, 5)))
+        sections = "".join(
+            '<div class="mw-heading mw-heading2"><h2 id="s{n}">{heading}</h2></div>{paragraphs}'.format(
+                n=n, heading=_word_name(rng, 3), paragraphs="".join(
+                    "<p>{text}</p>".format(text=_cited(rng, _sentences(rng, rng.randint(3, 8)), references))
+                    for _ in range(rng.randint(2, 6))))
+            for n in range(rng.randint(3, 10)))
+        content = ('<div class="mw-content-ltr mw-parser-output" lang="en" dir="ltr">'
+                   '<div class="shortdescription">{title}</div>{infobox}{lead}{sections}</div>').format(
+            title=escape(title), infobox=infobox, lead=lead, sections=sections)
+        return self._wrap(title, content + _padding(rng, rng.randint(20000, 80000)))
+
+    @staticmethod
+    def _wrap(title, content):
+        return ('<!DOCTYPE html><html class="client-nojs" lang="en"><head><meta charset="UTF-8"/>'
+                '<title>{title} - Wikipedia</title><link rel="canonical" href="https://en.wikipedia.org/wiki/{link}"/>'
+                '</head><body class="mediawiki"><div id="content" class="mw-body"><h1 id="firstHeading">{title}</h1>'
+                '<div id="bodyContent">{content}</div></div></body></html>').format(
+            title=escape(title), link=quote(title.replace(" ", "_")), content=content)
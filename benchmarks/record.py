@@ -0,0 +1,66 @@
+"""
+Records the live Wikipedia pages benchmarks use into benchmarks/fixtures, so runs measure real markup.
+
+Run from the repository root, with network access:
+    python -m benchmarks.record [--articles 100]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+
+from benchmarks import fixtures as fixture_pages
+from commands import warship
+from helpers import fetch, wiki
+
+
+async def record(articles):
+    """
+    :param articles: Int ; ship articles to record, picked at random from the list pages
+    :return: NoneType
+    """
+
+    os.makedirs(fixture_pages.RECORDED_DIR, exist_ok=True)
+
+    def save(title, html):
+        with open(os.path.join(fixture_pages.RECORDED_DIR, fixture_pages.page_file_name(title)), "w",
+                  encoding="utf-8") as file:
+            file.write(html)
+
+    page_names = [warship.get_page_name(_type) for _type in warship.TYPE_NAMES]
+    revisions = await wiki.get_revision_ids(page_names)
+    link_titles = {}  # ship name: link title ; by name like the ship store, so the same articles are picked
+    for page_name in page_names:
+        html = await fetch.fetch_text(wiki.get_article_url(page_name))
+        save(page_name, html)
+        for cells, link in wiki.get_table_rows(html):
+            try:
+                ship = warship.process_row(cells, link)
+            except IndexError:
+                continue
+            link_titles[ship["name"]] = ship["link title"]
+
+    titles = sorted({title for title in link_titles.values() if title})
+    for title in random.Random(fixture_pages.DEFAULT_SEED).sample(titles, min(articles, len(titles))):
+        try:
+            save(title, await fetch.fetch_text(wiki.get_article_url(title)))
+        except fetch.ERRORS as e:
+            print("Skipped {title}: {e}".format(title=title, e=e))
+
+    with open(os.path.join(fixture_pages.RECORDED_DIR, fixture_pages.REVISIONS_FILE), "w", encoding="utf-8") as file:
+        json.dump(revisions, file, indent=2)
+    print("Recorded {n} pages.".format(n=len(os.listdir(fixture_pages.RECORDED_DIR)) - 1))
+    await fetch.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--articles", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.get_event_loop().run_until_complete(record(args.articles))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,463 @@
+"""
+Offline benchmarks of scrapping, ship lookups, and whole commands, against fixture pages and fake clients.
+
+Run from the repository root:
+    python -m benchmarks.run [--rounds 5] [--ships 300] [--concurrency 10] [--parse-pool N] [--output file]
+                             [--compare file]
+
+Results are written as JSON, tagged with the commit and a digest of the fixtures, so runs on different commits
+can be compared with --compare. Only compare runs made on the same machine.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import gc
+import io
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import fakes, fixtures as fixture_pages
+from commands import google, warship, website
+from helpers import article_cache, logs, parse_pool, ship_store, wiki
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+SEED = 1945
+ADDRESSES = ["{n} {street} Street, {city}".format(n=n, street=street, city=city)
+             for n in (10, 220, 3400) for street in ("Main", "King", "Queen") for city in ("Edmonton", "Calgary")]
+SUBREDDITS = ["warships", "android", "python", "history", "aww", "space", "navy", "maps"]
+
+
+def get_commit():
+    """
+    :return: Tuple in form (commit hash, Bool) ; the Bool is whether tracked files have uncommitted changes
+    """
+
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT).decode().strip()
+        status = subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT)
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return commit, bool(status.strip())
+
+
+async def run_commands(calls, concurrency):
+    """
+    :param calls: List of functions taking nothing and returning a command coroutine
+    :param concurrency: Int ; commands in flight at once, like several users typing at the same time
+    :return: Int ; commands run
+    """
+
+    for i in range(0, len(calls), concurrency):
+        await asyncio.gather(*(call() for call in calls[i:i + concurrency]))
+    return len(calls)
+
+
+class Suite:
+
+    def __init__(self, fixtures, rounds, concurrency):
+        """
+        :param fixtures: benchmarks.fixtures.Fixtures
+        :param rounds: Int ; each benchmark reports the median and best of this many timed rounds
+        :param concurrency: Int
+        """
+
+        self._fixtures = fixtures
+        self._rounds = rounds
+        self._concurrency = concurrency
+        self._bot = fakes.FakeBot()
+        self.results = {}
+
+    async def measure(self, name, unit, run, setup=None):
+        """
+        :param name: Str
+        :param unit: Str ; what run() counts, e.g. "rows"
+        :param run: Coroutine function taking setup()'s result and returning how many units it processed
+        :param setup: Coroutine function taking nothing, run untimed before every round, or NoneType
+        :return: NoneType
+        """
+
+        rates = []
+        for _ in range(self._rounds):
+            random.seed(SEED)
+            with contextlib.redirect_stdout(io.StringIO()):
+                state = await setup() if setup else None
+                gc.collect()
+                start = time.perf_counter()
+                count = await run(state)
+                elapsed = time.perf_counter() - start
+            rates.append(count / elapsed)
+
+        median = statistics.median(rates)
+        self.results[name] = {"unit": unit + "/s", "median": median, "best": max(rates), "rounds": rates}
+        print("{name:<36}{median:>14,.1f}{best:>14,.1f}  {unit}/s".format(name=name, median=median, best=max(rates),
+                                                                          unit=unit))
+
+    async def measure_stall(self, name, run, setup=None):
+        """
+        Measures the longest the event loop went without getting to run anything else while run() was going, which
+        is how long a command or a Discord heartbeat could have been held up.
+        :param name: Str
+        :param run: Coroutine function taking setup()'s result
+        :param setup: Coroutine function taking nothing, run untimed before every round, or NoneType
+        :return: NoneType
+        """
+
+        stalls = []
+        for _ in range(self._rounds):
+            random.seed(SEED)
+            with contextlib.redirect_stdout(io.StringIO()):
+                state = await setup() if setup else None
+                gc.collect()
+                job = asyncio.ensure_future(run(state))
+                longest = 0.0
+                last = time.perf_counter()
+                while not job.done():
+                    await asyncio.sleep(0.001)
+                    now = time.perf_counter()
+                    longest = max(longest, now - last)
+                    last = now
+                job.result()
+            stalls.append(longest * 1000)
+
+        median = statistics.median(stalls)
+        self.results[name] = {"unit": "ms", "median": median, "best": min(stalls), "rounds": stalls}
+        print("{name:<36}{median:>14,.1f}{best:>14,.1f}  ms stalled".format(name=name, median=median, best=min(stalls)))
+
+    async def _new_warship_cog(self):
+        """
+        :return: warship.Warship ; with an empty article cache, and the store generated earlier loaded from disk
+        """
+
+        if os.path.exists(article_cache.DEFAULT_PATH):
+            os.remove(article_cache.DEFAULT_PATH)
+        with contextlib.redirect_stdout(io.StringIO()):
+            cog = warship.Warship(self._bot)
+            await cog.warm_up()
+        return cog
+
+    async def run(self):
+        print("{name:<36}{median:>14}{best:>14}".format(name="benchmark", median="median", best="best"))
+        await self._scrapping()
+        await self._startup()
+        await self._lookups()
+        await self._commands()
+        await self._responsiveness()
+        await self._logging()
+
+    async def _scrapping(self):
+        page_names = [warship.get_page_name(_type) for _type in warship.TYPE_NAMES]
+
+        async def scrap(_):
+            ships = {}
+            for page_name in page_names:
+                await warship.scrap_wiki_table_by_type(page_name, ships)
+            return len(ships)
+
+        await self.measure("scrap_wiki_table_by_type", "rows", scrap)
+
+        async def get_table_rows(_):
+            return sum(len(wiki.get_table_rows(self._fixtures.page(page_name))) for page_name in page_names)
+
+        await self.measure("get_table_rows", "rows", get_table_rows)
+
+        # Rows parsed once up front, so only process_row() is timed
+        rows = [row for page_name in page_names for row in wiki.get_table_rows(self._fixtures.page(page_name))]
+
+        async def process(_):
+            for cells, link in rows:
+                try:
+                    warship.process_row(cells, link)
+                except IndexError:
+                    pass
+            return len(rows)
+
+        await self.measure("process_row", "rows", process)
+
+        async def remove_store():
+            if os.path.exists(ship_store.DEFAULT_PATH):
+                os.remove(ship_store.DEFAULT_PATH)
+
+        async def generate(_):
+            await warship.generate_warship_cache()
+            return 1
+
+        await self.measure("generate_warship_cache (cold)", "runs", generate, remove_store)
+
+        async def load(_):
+            warship.load_warship_data()
+            return 1
+
+        await self.measure("load_warship_data", "runs", load)
+
+    async def _startup(self):
+        modules = ", ".join("commands." + name for name in ("basic", "warship", "website", "google", "stats"))
+
+        async def import_cogs(_):
+            # A fresh interpreter, so nothing is imported yet
+            subprocess.check_call([sys.executable, "-c", "import " + modules], cwd=ROOT)
+            return 1
+
+        await self.measure("start python and import cogs", "runs", import_cogs)
+
+        async def new_cog():
+            if os.path.exists(article_cache.DEFAULT_PATH):
+                os.remove(article_cache.DEFAULT_PATH)
+            return warship.Warship(self._bot)
+
+        async def warm_up(cog):
+            await cog.warm_up()
+            return 1
+
+        await self.measure("Warship warm-up", "runs", warm_up, new_cog)
+
+        async def first_reply(cog):
+            # Logged in with nothing loaded; the first ?warship waits for warm-up, then fetches an article
+            cog.warm_up()
+            await warship.Warship.warship.callback(cog, fakes.make_context())
+            return 1
+
+        await self.measure("first ?warship after start", "replies", first_reply, new_cog)
+
+    async def _lookups(self):
+        cog = await self._new_warship_cog()
+        store = cog._data.store
+        rng = random.Random(SEED)
+        names = rng.sample(sorted(store.ships), min(500, len(store)))
+        names += sorted({ship.ship_class for ship in store.ships.values() if ship.ship_class})[:100]
+        names += ["Missing Ship {i}".format(i=i) for i in range(100)]
+
+        async def get_ship(_):
+            for _ in range(10):
+                for name in names:
+                    cog._get_ship(name)
+            return 10 * len(names)
+
+        await self.measure("_get_ship", "lookups", get_ship)
+
+        async def random_ship(_):
+            for i in range(5000):
+                cog._get_random_ship({}, str(i % 20))
+            return 5000
+
+        await self.measure("_get_random_ship (unfiltered)", "draws", random_ship)
+
+        filters = [{"nation": "Royal Navy"}, {"_type": "battleships", "years": (1940, 1943)},
+                   {"tons": (30000, None)}, {"nation": "minor", "_type": "aircraft carriers"}]
+
+        async def filtered_ship(_):
+            for i in range(5000):
+                cog._get_random_ship(filters[i % len(filters)], str(i % 20))
+            return 5000
+
+        await self.measure("_get_random_ship (filtered)", "draws", filtered_ship)
+
+    async def _commands(self):
+        concurrency = self._concurrency
+        warship_command = warship.Warship.warship.callback
+        more_command = warship.Warship.more.callback
+
+        def random_warships(cog, count):
+            return [lambda i=i: warship_command(cog, fakes.make_context(channel=str(i % 50), author=str(i)))
+                    for i in range(count)]
+
+        async def cold_cog():
+            return await self._new_warship_cog()
+
+        async def warship_cold(cog):
+            return await run_commands(random_warships(cog, 100), concurrency)
+
+        await self.measure("?warship (cold article cache)", "commands", warship_cold, cold_cog)
+
+        async def prefetch(cog):
+            await cog.start_prefetch()
+            return len({ship.link_title for ship in cog._data.store.ships.values() if ship.link_title})
+
+        await self.measure("prefetch every article", "articles", prefetch, cold_cog)
+
+        async def prefetched_cog():
+            cog = await self._new_warship_cog()
+            await cog.start_prefetch()
+            return cog
+
+        await self.measure("?warship (articles prefetched)", "commands", warship_cold, prefetched_cog)
+
+        cog = await self._new_warship_cog()
+        names = random.Random(SEED).sample(sorted(cog._data.store.ships), 50)
+        await run_commands([lambda name=name: warship_command(cog, fakes.make_context(), str_args=name)
+                            for name in names], concurrency)
+
+        async def warship_warm(_):
+            calls = [lambda i=i: warship_command(cog, fakes.make_context(author=str(i)), str_args=names[i % 50])
+                     for i in range(1000)]
+            return await run_commands(calls, concurrency)
+
+        await self.measure("?warship (warm)", "commands", warship_warm)
+
+        async def warship_filtered(_):
+            calls = [lambda i=i: warship_command(cog, fakes.make_context(author=str(i)), str_args="-n rn -y 1930-1945")
+                     for i in range(200)]
+            return await run_commands(calls, concurrency)
+
+        await self.measure("?warship -n rn -y 1930-1945", "commands", warship_filtered)
+
+        async def more(_):
+            calls = [lambda i=i: more_command(cog, fakes.make_context(author=str(i % 1000))) for i in range(2000)]
+            return await run_commands(calls, concurrency)
+
+        await self.measure("?more", "commands", more)
+
+        reddit_cog = website.Website(self._bot)
+        reddit_cog._reddit = fakes.FakeReddit()
+        reddit_command = website.Website.reddit.callback
+
+        async def reddit(_):
+            calls = [lambda i=i: reddit_command(reddit_cog, fakes.make_context(), SUBREDDITS[i % len(SUBREDDITS)])
+                     for i in range(1000)]
+            return await run_commands(calls, concurrency)
+
+        await self.measure("?reddit", "commands", reddit)
+
+        maps_cog = google.GoogleMaps(self._bot)
+        maps_cog._maps = fakes.FakeMaps()
+        distances_command = google.GoogleMaps.distances.callback
+        nearby_command = google.GoogleMaps.nearby.callback
+
+        async def distances(_):
+            rng = random.Random(SEED)
+            calls = [lambda ends=rng.sample(ADDRESSES, 4): distances_command(maps_cog, fakes.make_context(), *ends)
+                     for _ in range(200)]
+            return await run_commands(calls, concurrency)
+
+        await self.measure("?distances", "commands", distances)
+
+        async def nearby(_):
+            calls = [lambda i=i: nearby_command(maps_cog, fakes.make_context(), "Cafes", *ADDRESSES[i % 5].split())
+                     for i in range(500)]
+            return await run_commands(calls, concurrency)
+
+        await self.measure("?nearby", "commands", nearby)
+
+    async def _responsiveness(self):
+        async def refresh(cog):
+            # Everything changed, so both lists are scrapped again, then some of their articles downloaded
+            await warship.generate_warship_cache()
+            titles = sorted({ship.link_title for ship in cog._data.store.ships.values() if ship.link_title})
+            await cog._articles.prefetch(titles[:60], warship.ENRICH_CONCURRENCY)
+
+        async def cold_cog():
+            return await self._new_warship_cog()
+
+        await self.measure_stall("loop stall while refreshing", refresh, cold_cog)
+
+    async def _logging(self):
+        gateway = logging.getLogger("discord.gateway")
+        event = json.dumps({"op": 0, "t": "MESSAGE_CREATE", "d": {"content": "?warship " * 30, "id": "3" * 18,
+                                                                  "author": {"id": "1" * 18, "username": "someone"}}})
+
+        def events(levels):
+            async def start():
+                logs.start(levels=levels)  # Also stops the last round's logging, writing out what it queued
+
+            async def receive(_):
+                # What discord.py does with every gateway event; only the time the event loop's thread spends counts
+                for _ in range(20000):
+                    gateway.debug("WebSocket Event: {}".format(event))
+                return 20000
+
+            return receive, start
+
+        await self.measure("gateway events (default log levels)", "events", *events(logs.LEVELS))
+        await self.measure("gateway events (logged at DEBUG)", "events", *events("WARNING,discord=DEBUG"))
+        logs.stop()
+
+
+def compare(results, baseline):
+    """
+    :param results: Dict ; this run's output
+    :param baseline: Dict ; an earlier run's output
+    :return: NoneType
+    """
+
+    print()
+    print("Compared with {commit}:".format(commit=baseline["commit"][:10]))
+    if baseline["fixtures"] != results["fixtures"]:
+        print("Warning: the runs used different fixtures, so they aren't comparable.")
+    for name, result in results["results"].items():
+        old = baseline["results"].get(name)
+        if old:
+            # Stalls are better lower, everything else higher
+            change = result["median"] / old["median"] - 1
+            print("{name:<36}{change:>+9.1%}{better:>10}".format(
+                name=name, change=change, better="better" if (change < 0) == (result["unit"] == "ms") else "worse"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--ships", type=int, default=fixture_pages.DEFAULT_SHIPS_PER_LIST,
+                        help="rows in each generated list page")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--parse-pool", type=int, default=parse_pool.POOL_SIZE,
+                        help="worker processes for parsing; 0 parses in a thread")
+    parser.add_argument("--output", help="where to write results; benchmarks/results/<commit>.json by default")
+    parser.add_argument("--compare", help="results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    commit, dirty = get_commit()
+    parse_pool.POOL_SIZE = args.parse_pool
+    fixtures = fixture_pages.Fixtures(args.ships)
+    fakes.install(fixtures)
+    page_names = [warship.get_page_name(_type) for _type in warship.TYPE_NAMES]
+    print("Commit {commit}{dirty}; {recorded} recorded pages, the rest generated.".format(
+        commit=commit[:10], dirty=" (uncommitted changes)" if dirty else "", recorded=fixtures.recorded))
+
+    # Cogs keep their data under ./data, so give them somewhere disposable
+    work_dir = tempfile.mkdtemp(prefix="plasma-bench-")
+    os.chdir(work_dir)
+    suite = Suite(fixtures, args.rounds, args.concurrency)
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(suite.run())
+    finally:
+        parse_pool.shutdown()
+        os.chdir(ROOT)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    results = {
+        "commit": commit,
+        "dirty": dirty,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "fixtures": {"digest": fixtures.digest(page_names), "recorded": fixtures.recorded, "ships": args.ships,
+                     "seed": fixtures.seed},
+        "rounds": args.rounds,
+        "concurrency": args.concurrency,
+        "parse pool": args.parse_pool,
+        "results": suite.results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, commit[:10] + ("-dirty" if dirty else "") + ".json")
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+    print("Results written to {path}".format(path=output))
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            compare(results, json.load(file))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,42 +5,45 @@ Rudimentary Discord commands.
 import random
 from discord.ext import commands
 
+from helpers import outbox
+
 
 class Basic:
 
     def __init__(self, bot):
         self._bot = bot
+        self._outbox = outbox.get_outbox(bot)
 
-    @commands.command()
-    async def coin(self):
+    @commands.command(pass_context=True)
+    async def coin(self, context):
         side = {0: "heads",
                 1: "tails"}
         reply = "Coin landed {side}.".format(side=random.choice(side))
-        await self._bot.say(reply)
+        await self._outbox.send(context.message.channel, reply)
 
-    @commands.command()
-    async def dice(self):
+    @commands.command(pass_context=True)
+    async def dice(self, context):
         reply = "Rolled a {side}.".format(side=random.randint(1, 6))
-        await self._bot.say(reply)
+        await self._outbox.send(context.message.channel, reply)
 
-    @commands.command()
-    async def choose(self, *args):
+    @commands.command(pass_context=True)
+    async def choose(self, context, *args):
         try:
             reply = "I choose {choice}.".format(choice=random.choice(args))
         except IndexError:
             reply = "I choose nothing."
-        await self._bot.say(reply)
+        await self._outbox.send(context.message.channel, reply)
 
-    @commands.command()
-    async def int(self, lower=1, upper=10):
+    @commands.command(pass_context=True)
+    async def int(self, context, lower=1, upper=10):
         try:
             reply = "I choose {num}.".format(num=random.randint(int(lower), int(upper)))
         except ValueError:
             reply = "I choose {num}.".format(num=random.randint(int(upper), int(lower)))
-        await self._bot.say(reply)
+        await self._outbox.send(context.message.channel, reply)
 
-    @commands.command()
-    async def help(self, command=None):
+    @commands.command(pass_context=True)
+    async def help(self, context, command=None):
         delimiter = "?"
         if command is None:
             s = (
@@ -57,20 +60,27 @@ class Basic:
                 "{d}reddit <subreddit name>: gets random hot submission from subreddit\n"
                 "\n"
                 "{d}distance <start> <end>: gets distance in kilometers and time to drive between two places\n"
+                "{d}distances <start> <end 1> <end 2> <etc>: same as {d}distance, to several places at once\n"
                 "{d}nearby <query> <location>: gets points-of-interest near an address\n"
                 "{d}makeit <query>: calculates if you can walk from one place to another in 10 minutes\n"
                 "\n"
                 "{d}warship <optional specification>: looks up or gets random WW2-era ships\n"
-                "{d}more: loads more information from last `{d}warship` call\n"
-                "{d}refresh: reloads warship database; use sparingly\n"
+                "{d}more: loads more information from your last `{d}warship` call in the channel\n"
+                "{d}refresh: reloads warship database in the background; use sparingly\n"
+                "\n"
+                "{d}stats: shows how fast commands are and how well caches are doing\n"
                 "```"
             ).format(d=delimiter)
         elif command == "warship":
             s = (
                 "```\n"
                 "Gets a random WW2-era warship class via Wikipedia.\n"
-                "Use -n to specify a navy/nation, -t to specify a hull type.\n"
-                "Enter a name to look a ship up.\n"
+                "Use -n to specify a navy/nation, -t to specify a hull type,\n"
+                "-c for a class, -f for words in its fate (e.g. sunk by aircraft),\n"
+                "-y for commission years and -d for displacement in tons.\n"
+                "Years and displacements can be ranges, e.g. 1940-1942 or 30000-.\n"
+                "Filters can be combined.\n"
+                "Enter a name to look a ship up, or a class to get one of its ships.\n"
                 "Leave it blank to get totally random ship.\n"
                 "\n"
                 "Navies: IJN, USN, KM, RN, RM, FN, minor\n"
@@ -96,6 +106,7 @@ class Basic:
                 "\n"
                 "`{d}warship -t cv` to get an aircraft carrier\n"
                 "`{d}warship -n rn` to get a British ship\n"
+                "`{d}warship -n ijn -t bb -f sunk -y 1940-1945` to get a sunk Japanese battleship\n"
                 "`{d}warship` to get a random ship\n"
                 "`{d}warship Ark Royal` to look up the Ark Royal"
             ).format(d=delimiter)
@@ -106,6 +117,12 @@ class Basic:
                 "Example usage: `{d}distance New York City Los Angeles` doesn't work, but "
                 "`{d}distance NewYorkCity LosAngeles` does."
             ).format(d=delimiter)
+        elif command == "distances":
+            s = (
+                "Each place must be a string with no spaces, like with `{d}distance`.\n"
+                "\n"
+                "Example usage: `{d}distances NewYorkCity Boston Philadelphia WashingtonDC`"
+            ).format(d=delimiter)
         elif command == "nearby":
             s = (
                 "Places that are explicitly listed as closed are ignored.\n"
@@ -123,4 +140,4 @@ class Basic:
             ).format(d=delimiter)
         else:
             s = "Doesn't get any more detailed than what's listed in `{d}help`, kiddo.".format(d=delimiter)
-        await self._bot.say(s)
+        await self._outbox.send(context.message.channel, s)
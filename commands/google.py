@@ -2,12 +2,123 @@
 Commands that utilize Google APIs, and their related functions.
 """
 
+import asyncio
 import discord
 from discord.ext import commands
-import googlemaps
+import functools
 import os
+from collections import namedtuple
 
-from helpers import text_manipulation as text
+from helpers import geocode_cache, metrics, outbox, ratelimit, singleflight, text_manipulation as text
+
+BATCH_WINDOW = 0.05  # Seconds to wait for more lookups from the same origin before calling Google
+MAX_DESTINATIONS = 25  # Per distance matrix request, as documented by Google
+
+# Distance and duration are Google's display text, or NoneType if there's no route
+DistanceResult = namedtuple("DistanceResult", ["origin", "destination", "distance", "duration"])
+
+
+class DistanceBatcher:
+    """
+    Merges distance lookups from one origin in one mode, made within a short window, into a single distance matrix
+    request. Each merged lookup still costs one element of quota, but they share a round trip.
+    """
+
+    def __init__(self, request, window=BATCH_WINDOW, max_destinations=MAX_DESTINATIONS):
+        """
+        :param request: Coroutine function taking (origin Place, List of destination Places, mode) and returning
+            the raw distance matrix response
+        :param window: Number ; seconds
+        :param max_destinations: Int
+        """
+
+        self._request = request
+        self._window = window
+        self._max_destinations = max_destinations
+        self._pending = {}  # (origin, mode): [(destination, future)]
+        self.requests = 0
+        self.lookups = 0
+
+    async def lookup(self, origin, destinations, mode):
+        """
+        :param origin: geocode_cache.Place
+        :param destinations: List of geocode_cache.Place
+        :param mode: Str ; e.g. "driving"
+        :return: List of DistanceResult, in the same order as destinations
+        """
+
+        loop = asyncio.get_event_loop()
+        futures = []
+        key = (origin, mode)
+        for destination in destinations:
+            future = loop.create_future()
+            futures.append(future)
+            if key not in self._pending:
+                self._pending[key] = []
+                loop.call_later(self._window, self._flush, key)
+            self._pending[key].append((destination, future))
+            self.lookups += 1
+            if len(self._pending[key]) >= self._max_destinations:
+                self._flush(key)
+        return list(await asyncio.gather(*futures))
+
+    def _flush(self, key):
+        """
+        Sends whatever is pending for key, if it hasn't been sent already.
+        :param key: Tuple in form (origin, mode)
+        :return: NoneType
+        """
+
+        batch = self._pending.pop(key, None)
+        if batch:
+            asyncio.ensure_future(self._send(key, batch))
+
+    async def _send(self, key, batch):
+        """
+        :param key: Tuple in form (origin, mode)
+        :param batch: List of (destination, future) tuples
+        :return: NoneType
+        """
+
+        origin, mode = key
+        destinations = list(dict.fromkeys(destination for destination, _ in batch))  # Same place asked twice
+        self.requests += 1
+        try:
+            result_dict = await self._request(origin, destinations, mode)
+
+            # A response in an unexpected shape fails the batch too, so nobody waits on it forever
+            elements = result_dict["rows"][0]["elements"]
+            results = {}
+            for i, destination in enumerate(destinations):
+                element = elements[i]
+                if element.get("status") == "OK":
+                    distance, duration = element["distance"]["text"], element["duration"]["text"]
+                else:
+                    distance = duration = None
+                results[destination] = DistanceResult(origin.address, destination.address, distance, duration)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for destination, future in batch:
+            if not future.done():
+                future.set_result(results[destination])
+
+
+def should_retry(error):
+    """
+    :param error: Exception raised by googlemaps.Client
+    :return: Bool ; whether it's worth trying again after backing off
+    """
+
+    import googlemaps  # Already imported by whatever raised
+    if isinstance(error, googlemaps.exceptions.HTTPError):
+        return ratelimit.is_retryable_status(error.status_code)
+    if isinstance(error, googlemaps.exceptions.ApiError):
+        return error.status == "OVER_QUERY_LIMIT"
+    return False
 
 
 class GoogleMaps:
@@ -15,9 +126,120 @@ class GoogleMaps:
     def __init__(self, bot):
 
         self._bot = bot
-        self._maps = googlemaps.Client(key=os.environ["GOOGLE_MAPS_KEY"])
+        self._outbox = outbox.get_outbox(bot)
+        self._maps = None
+        self._geocodes = geocode_cache.GeocodeCache()
+        self._distances = DistanceBatcher(self._request_distances)
+        metrics.register_cache("geocodes", self._geocodes)
+        metrics.register_stats("distance batching", lambda: {"lookups": self._distances.lookups,
+                                                             "requests": self._distances.requests})
+
+    def _get_maps(self):
+        """
+        Creates the client on first use, as googlemaps is slow to import.
+        :return: googlemaps.Client
+        """
+
+        if self._maps is None:
+            import googlemaps
+            # Backoff is done here rather than by the client, so give up on its own retrying quickly
+            self._maps = googlemaps.Client(key=os.environ["GOOGLE_MAPS_KEY"], retry_timeout=10)
+        return self._maps
+
+    async def _call(self, method, *args, **kwargs):
+        """
+        Runs a blocking googlemaps client method in an executor, within the rate limit and with backoff.
+        :param method: Bound method of googlemaps.Client
+        :raises ratelimit.Busy: if the rate limit would take too long to clear
+        :return: Whatever the method returns
+        """
+
+        loop = asyncio.get_event_loop()
+
+        async def attempt():
+            await ratelimit.limiter.acquire("google")
+            with metrics.timed_call("google"):
+                return await loop.run_in_executor(None, functools.partial(method, *args, **kwargs))
+
+        return await ratelimit.with_backoff(attempt, should_retry)
+
+    @staticmethod
+    async def _admit(context):
+        """
+        Take the guild's turn at the API.
+        :param context: commands.Context
+        :raises ratelimit.Busy: if the guild has used up its share for now
+        :return: NoneType
+        """
+
+        server = context.message.server
+        await ratelimit.limiter.admit("google", server.id if server else None)
+
+    async def geocode(self, location):
+        """
+        Get coordinates and address of a location, from the cache if it's been looked up before.
+        :param location: Str
+        :return: geocode_cache.Place or NoneType if Google doesn't know it
+        """
+
+        place = self._geocodes.get(location)
+        if place is None:
+            key = ("geocode", geocode_cache.normalize_address(location))
+            place = await singleflight.group.do(key, lambda: self._fetch_geocode(location))
+        return place
+
+    async def _fetch_geocode(self, location):
+        """
+        :param location: Str
+        :return: geocode_cache.Place or NoneType
+        """
+
+        results = await self._call(self._get_maps().geocode, location)
+        if not results:
+            return None
+        coordinates = results[0]["geometry"]["location"]
+        place = geocode_cache.Place(coordinates["lat"], coordinates["lng"], results[0]["formatted_address"])
+        self._geocodes.put(location, place)
+        return place
 
-    def get_distance_time(self, start, end, mode):
+    async def _request_distances(self, origin, destinations, mode):
+        """
+        :param origin: geocode_cache.Place
+        :param destinations: List of geocode_cache.Place
+        :param mode: Str
+        :return: Dict ; the raw distance matrix response
+        """
+
+        return await self._call(self._get_maps().distance_matrix, origins=[(origin.lat, origin.lng)],
+                                destinations=[(place.lat, place.lng) for place in destinations],
+                                units="metric", mode=mode)
+
+    async def get_distances(self, start, ends, mode):
+        """
+        Given one start and many end locations, get the distance and time to travel to each.
+        :param start: Str
+        :param ends: List of Str
+        :param mode: Str
+        :return: List of DistanceResult or NoneType (for ends that couldn't be found), or NoneType if start
+            couldn't be found
+        """
+
+        places = await asyncio.gather(self.geocode(start), *(self.geocode(end) for end in ends))
+        origin, destinations = places[0], places[1:]
+        if origin is None:
+            return None
+
+        # Identical routes in flight are shared; different ones from this origin still merge in the batcher
+        async def route(destination):
+            if destination is None:
+                return None
+            results = await singleflight.group.do(("route", origin, destination, mode),
+                                                  lambda: self._distances.lookup(origin, [destination], mode))
+            return results[0]
+
+        return list(await asyncio.gather(*(route(destination) for destination in destinations)))
+
+    async def get_distance_time(self, start, end, mode):
         """
         Given start and end location, and the mode of travel, return distance and time to travel in a string.
         :param start: Str
@@ -25,21 +247,54 @@ class GoogleMaps:
         :param mode: Str
         :return: Str
         """
-        result_dict = self._maps.distance_matrix(origins=start, destinations=end, units="metric", mode=mode)
-        origin, destination = result_dict["origin_addresses"][0], result_dict["destination_addresses"][0]
-        try:
-            dis = result_dict["rows"][0]["elements"][0]["distance"]["text"]
-            time = result_dict["rows"][0]["elements"][0]["duration"]["text"]
-        except KeyError:
+
+        results = await self.get_distances(start, [end], mode)
+        result = results[0] if results else None
+        if result is None or result.distance is None:
             reply = "No results from Google."
         else:
-            reply = "From {o} to {d}\n{dis}\n{time}".format(o=origin, d=destination, dis=dis, time=time)
+            reply = "From {o} to {d}\n{dis}\n{time}".format(o=result.origin, d=result.destination,
+                                                            dis=result.distance, time=result.duration)
         return reply
 
     @commands.command(pass_context=True)
     async def distance(self, context, start, end, *args):
-        reply = self.get_distance_time(start, end, "driving")
-        await self._bot.send_message(context.message.channel, text.codeblock(reply))
+        try:
+            await self._admit(context)
+            reply = await self.get_distance_time(start, end, "driving")
+        except ratelimit.Busy:
+            reply = ratelimit.BUSY_REPLY
+        await self._outbox.send(context.message.channel, text.codeblock(reply))
+
+    @commands.command(pass_context=True)
+    async def distances(self, context, start, *ends):
+        """
+        Like ?distance, to several places at once.
+        """
+
+        if not ends:
+            await self._outbox.send(context.message.channel, text.codeblock("No destinations given."))
+            return
+
+        try:
+            await self._admit(context)
+            results = await self.get_distances(start, list(ends), "driving")
+        except ratelimit.Busy:
+            await self._outbox.send(context.message.channel, text.codeblock(ratelimit.BUSY_REPLY))
+            return
+
+        if results is None:
+            reply = "No results from Google for {start}.".format(start=start)
+        else:
+            lines = ["From {o}".format(o=next((r.origin for r in results if r), start))]
+            for end, result in zip(ends, results):
+                if result is None or result.distance is None:
+                    lines.append("{d}: no results".format(d=result.destination if result else end))
+                else:
+                    lines.append("{d}: {dis}, {time}".format(d=result.destination, dis=result.distance,
+                                                              time=result.duration))
+            reply = "\n".join(lines)
+        await self._outbox.send(context.message.channel, text.codeblock(reply))
 
     @commands.command(pass_context=True)
     async def makeit(self, context, *args):
@@ -55,12 +310,20 @@ class GoogleMaps:
         else:
             start, end = string.split(" ")
 
-        dis_and_time = self.get_distance_time(start, end, "walking").split("\n")[1:]
-        if "min" in dis_and_time[1] and int(dis_and_time[1].split(" ")[-2]) <= 10:
+        try:
+            await self._admit(context)
+            dis_and_time = (await self.get_distance_time(start, end, "walking")).split("\n")[1:]
+        except ratelimit.Busy:
+            await self._outbox.send(context.message.channel, text.codeblock(ratelimit.BUSY_REPLY))
+            return
+
+        if not dis_and_time:
+            possible = "No results from Google."
+        elif "min" in dis_and_time[1] and int(dis_and_time[1].split(" ")[-2]) <= 10:
             possible = "Yes! You can make it in 10 minutes."
 
         reply = possible + "\n" + ", ".join(dis_and_time)
-        await self._bot.send_message(context.message.channel, text.codeblock(reply))
+        await self._outbox.send(context.message.channel, text.codeblock(reply))
 
     @commands.command(pass_context=True)
     async def nearby(self, context, query, *args):
@@ -71,11 +334,18 @@ class GoogleMaps:
 
         location = " ".join(args)
 
-        longlat = self._maps.geocode(location)[0]["geometry"]["location"]
-        readable_location = self._maps.geocode(location)[0]["formatted_address"]
-        result_dict = self._maps.places(query=query, location=longlat)
+        try:
+            await self._admit(context)
+            place = await self.geocode(location)
+            if place is None:
+                await self._outbox.send(context.message.channel, text.codeblock("No results from Google."))
+                return
+            result_dict = await self._call(self._get_maps().places, query=query, location=(place.lat, place.lng))
+        except ratelimit.Busy:
+            await self._outbox.send(context.message.channel, text.codeblock(ratelimit.BUSY_REPLY))
+            return
 
-        embeded_object = discord.Embed(title="Near {address}".format(address=readable_location), color=0x00ff00)
+        embeded_object = discord.Embed(title="Near {address}".format(address=place.address), color=0x00ff00)
         num_places = 10
 
         for place in result_dict["results"]:
@@ -95,4 +365,4 @@ class GoogleMaps:
             if num_places == 0:
                 break
 
-        await self._bot.send_message(context.message.channel, embed=embeded_object)
+        await self._outbox.send(context.message.channel, embed=embeded_object)
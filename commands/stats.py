@@ -0,0 +1,108 @@
+"""
+Commands that report how the bot itself is performing.
+"""
+
+from discord.ext import commands
+
+from helpers import metrics, outbox, ratelimit, singleflight
+from helpers import text_manipulation as text
+
+MESSAGE_LIMIT = 2000  # Characters Discord allows in one message
+
+
+def format_ms(seconds):
+    """
+    :param seconds: Float or NoneType
+    :return: Str
+    """
+    return "-" if seconds is None else "{:.0f}".format(seconds * 1000)
+
+
+def format_latencies(title, table):
+    """
+    :param title: Str
+    :param table: Dict in form {name: metrics.Histogram}
+    :return: List of Str
+    """
+
+    lines = ["{title:<16}{n:>7}{err:>5}{p50:>8}{p95:>8}{p99:>8}".format(
+        title=title, n="calls", err="err", p50="p50 ms", p95="p95 ms", p99="p99 ms")]
+    for name, histogram in sorted(table.items()):
+        p50, p95, p99 = (format_ms(p) for p in histogram.percentiles(0.5, 0.95, 0.99))
+        lines.append("{name:<16}{n:>7}{err:>5}{p50:>8}{p95:>8}{p99:>8}".format(
+            name=name[:15], n=histogram.count, err=histogram.errors, p50=p50, p95=p95, p99=p99))
+    return lines
+
+
+def pack_sections(sections, limit=MESSAGE_LIMIT):
+    """
+    Fits sections of a report into as few code block messages as possible, each under Discord's limit. Sections are
+    never split across messages; one too long for a message of its own is cut short.
+    :param sections: List of lists of Str ; lines of each section
+    :param limit: Int ; characters per message
+    :return: List of Str ; messages
+    """
+
+    room = limit - len(text.codeblock(""))
+    messages = []
+    current = ""
+    for lines in sections:
+        section = "\n".join(lines)
+        if len(section) > room:
+            section = section[:room - 2].rsplit("\n", 1)[0] + "\n…"
+        if current and len(current) + 2 + len(section) <= room:
+            current += "\n\n" + section
+        else:
+            if current:
+                messages.append(text.codeblock(current))
+            current = section
+    if current:
+        messages.append(text.codeblock(current))
+    return messages
+
+
+class Stats:
+
+    def __init__(self, bot):
+        self._bot = bot
+        self._outbox = outbox.get_outbox(bot)
+        metrics.register_stats("single flight", self._single_flight_stats)
+        metrics.register_stats("rate limit", self._rate_limit_stats)
+
+    @staticmethod
+    def _single_flight_stats():
+        stats = {}
+        for namespace, counts in singleflight.group.stats().items():
+            stats[namespace + " calls"] = counts["calls"]
+            stats[namespace + " coalesced"] = counts["coalesced"]
+        return stats
+
+    @staticmethod
+    def _rate_limit_stats():
+        stats = {}
+        for service in ratelimit.limiter.throttled:
+            stats[service + " throttled"] = ratelimit.limiter.throttled[service]
+            stats[service + " rejected"] = ratelimit.limiter.rejected[service]
+        return stats
+
+    @commands.command(pass_context=True)
+    async def stats(self, context):
+        """Shows command latencies, outside calls, and cache hit ratios."""
+
+        sections = [format_latencies("Command", metrics.command_latencies),
+                    format_latencies("Upstream", metrics.upstream_latencies),
+                    format_latencies("Parse CPU", metrics.parse_times)]
+        lines = ["{:<22}{:>7}{:>8}{:>8}{:>7}".format("Cache", "size", "hits", "misses", "ratio")]
+        for name, stats in metrics.cache_stats().items():
+            lines.append("{name:<22}{size:>7}{hits:>8}{misses:>8}{ratio:>7.0%}".format(
+                name=name[:21], size=stats.get("size", 0), hits=stats["hits"], misses=stats["misses"],
+                ratio=stats["hit ratio"]))
+        sections.append(lines)
+        for name, stats in metrics.extra_stats().items():
+            if stats:
+                sections.append([name.capitalize() + ": " + ", ".join(
+                    "{k} {v}".format(k=k, v=v) for k, v in sorted(stats.items()))])
+
+        # The report outgrows one message once the bot has been used for a while
+        for message in pack_sections(sections):
+            await self._outbox.send(context.message.channel, message)
@@ -2,16 +2,16 @@
 Commands and functions related to the warship Discord command.
 """
 
+import asyncio
 import random
+import time
+import discord
 from discord.ext import commands
-from bs4 import BeautifulSoup
-from urllib.request import urlopen
-import wikipedia
-import pickle
-import json
-import unicodedata
+import os
 
-from helpers import text_manipulation, wiki
+from helpers import article_cache, cache, fetch, metrics, outbox, parse_pool, ratelimit, sampling, search
+from helpers import ship_query, ship_store, wiki
+from helpers import text_manipulation as text
 
 # TODO: remove redundant hull type constants
 NATIONS = {
@@ -28,101 +28,195 @@ HULL_TYPES = {
     "bb": "battleships",
 }
 TYPE_NAMES = ["battleships", "aircraft carriers"]
-
-
-def get_warship_data():
+FILTER_FLAGS = {
+    "-n": "nation",
+    "-t": "_type",
+    "-c": "_class",
+    "-f": "fate",
+    "-y": "years",
+    "-d": "tons"
+}
+# How unfiltered picks weight navies: "ship" makes every ship equally likely, "nation" every navy
+RANDOM_WEIGHTING = os.environ.get("WARSHIP_RANDOM_WEIGHTING", "ship")
+REPLY_CACHE_SIZE = int(os.environ.get("WARSHIP_REPLY_CACHE_SIZE", 256))
+SESSION_LIMIT = int(os.environ.get("WARSHIP_SESSION_LIMIT", 2000))
+SESSION_TTL = int(os.environ.get("WARSHIP_SESSION_TTL", 60 * 60))  # Seconds
+SESSION_MAX_CHARS = int(os.environ.get("WARSHIP_SESSION_MAX_CHARS", 4 * 1024 * 1024))
+LOADING_WAIT = 2  # Seconds a ?warship waits for data still loading before saying so
+LOADING_REPLY = "Warship data is still loading. Try again in a few seconds."
+REFRESH_INTERVAL = int(os.environ.get("WARSHIP_REFRESH_INTERVAL", 24 * 60 * 60))  # Seconds; 0 to only refresh on ?refresh
+ENRICH_CONCURRENCY = int(os.environ.get("WARSHIP_ENRICH_CONCURRENCY", 4))  # Articles downloaded at once by refreshes
+EMBED_COLOR = 0x5d6d7e  # Haze grey
+DESCRIPTION_LIMIT = 2048  # Characters Discord shows in an embed's description
+
+
+async def get_warship_data():
     """
-    Returns the cache of warship data.
-    :return: Tuple of Dicts
+    Returns the stored warship data, generating it if there is none. Reading it happens off the event loop.
+    :return: ShipStore
     """
 
-    cache = load_cache()
+    store = await asyncio.get_event_loop().run_in_executor(None, load_warship_data)
+    if store is None:
+        store, _ = await generate_warship_cache()
+    return store
 
-    if cache:
-        ships = cache[0]
-        ships_by_type = cache[1]
-        ships_by_nation = cache[2]
-    else:
-        ships, ships_by_type, ships_by_nation = generate_warship_cache()
 
-    return ships, ships_by_type, ships_by_nation
+def load_warship_data():
+    """
+    Reads the warship data from disk, without going online.
+    :return: ShipStore, or NoneType if nothing has been generated yet
+    """
+    return ship_store.ShipStore.load(NATIONS.values())
 
 
-def generate_warship_cache():
+def parse_filters(args):
     """
-    Fetches data and saves to cache.
-    :return: Three Dicts
+    Turns command arguments, e.g. "-n usn -t bb -y 1940-1943", into ShipQueryIndex.query() keyword arguments.
+    Values can be several words long; they run until the next flag.
+    :param args: List of Str
+    :return: Dict
     """
-    print("Generating ship data...")
-    ships = {}
-    ships_by_nation = {}
-    ships_by_type = {}
 
-    for nation in NATIONS.values():
-        ships_by_nation[nation] = []
+    values = {}
+    flag = None
+    for arg in args:
+        if arg in FILTER_FLAGS:
+            flag = arg
+            values[flag] = []
+        elif flag is None:
+            raise ValueError("Expected a flag, got {arg}".format(arg=arg))
+        else:
+            values[flag].append(arg)
 
-    for _type in TYPE_NAMES:
+    filters = {}
+    for flag, words in values.items():
+        value = " ".join(words)
+        if not value:
+            raise ValueError("No value given for {flag}".format(flag=flag))
+        try:
+            if flag == "-n":
+                value = NATIONS[value.lower()]
+            elif flag == "-t":
+                value = HULL_TYPES[value.lower()]
+            elif flag in ("-y", "-d"):
+                value = parse_range(value)
+        except KeyError:
+            raise ValueError("Unknown value {value} for {flag}".format(value=value, flag=flag))
+        filters[FILTER_FLAGS[flag]] = value
 
-        page_name = "List of {} of World War II".format(_type)
-        ships_of_type, nation_partial_dict = scrap_wiki_table_by_type(page_name, ships)
-        ships_by_type[_type] = ships_of_type
+    return filters
 
-        # Update nation lists
-        for nation, array in nation_partial_dict.items():
-            ships_by_nation[nation].extend(array)
 
-        print(_type + " is done.")
+def parse_range(text):
+    """
+    :param text: Str ; e.g. "1940", "1940-1943", "30,000-", or "-1941"
+    :return: Tuple in form (low, high) ; an open end is NoneType
+    """
 
-    save_cache(ships, ships_by_type, ships_by_nation)
-    print("Done.")
-    return ships, ships_by_type, ships_by_nation
+    low, sep, high = text.replace(",", "").partition("-")
+    low = int(low) if low.strip() else None
+    high = (int(high) if high.strip() else None) if sep else low
+    return low, high
 
 
-def load_cache():
+def get_page_name(_type):
     """
-    :return: Tuple of Dicts
+    :param _type: Str
+    :return: Str
     """
+    return "List of {} of World War II".format(_type)
 
-    # Todo: use JSON instead of object serialization
-    try:
-        with open("data\\cache.pkl", "rb") as file:
-            data = pickle.load(file)
-        r = (data["ships"], data["types"], data["nations"])
-    except FileNotFoundError:
-        r = ({}, {}, {})
 
-    return r
+class RefreshProgress:
+    """
+    How far along a refresh of the warship data is, for anyone asking while it runs.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.stage = "checking which lists changed"
+        self.done = 0
+        self.total = 0
+        self.unit = ""
+
+    def begin(self, stage, total=0, unit=""):
+        """
+        :param stage: Str ; e.g. "scrapping"
+        :param total: Int ; how many things the stage goes through, if it's worth saying
+        :param unit: Str ; what they are, e.g. "changed lists"
+        :return: NoneType
+        """
+
+        self.stage = stage
+        self.done = 0
+        self.total = total
+        self.unit = unit
+
+    def advance(self, done, total):
+        self.done = done
+        self.total = total
+
+    def describe(self):
+        """
+        :return: Str
+        """
+
+        text = "{stage}, {s:.0f} s in".format(stage=self.stage.capitalize(), s=time.monotonic() - self.started)
+        if self.total:
+            text += "; {done} of {total} {unit}".format(done=self.done, total=self.total, unit=self.unit)
+        return text + "."
 
 
-def save_cache(ships, types, nations):
+async def generate_warship_cache(store=None, progress=None):
     """
-    :param ships: Dict
-    :param types: Dict
-    :param nations: Dict
-    :return: NoneType
+    Fetches data and saves to cache. Given an existing store, only list pages edited since it was built are
+    re-scrapped, and merged into a copy of it, so a store in use is never modified.
+    Merging and saving happen off the event loop.
+    :param store: ShipStore or NoneType
+    :param progress: RefreshProgress or NoneType ; updated as each stage starts
+    :return: Tuple in form (ShipStore, list of types that were re-scrapped)
     """
+    print("Generating ship data...")
+    progress = progress or RefreshProgress()
 
-    with open("data\\cache.pkl", "wb") as file:
-        data = {"ships": ships, "types": types, "nations": nations}
-        pickle.dump(data, file)
+    # One API call says which pages changed; if it fails, assume they all did
+    page_names = [get_page_name(_type) for _type in TYPE_NAMES]
+    try:
+        revisions = await wiki.get_revision_ids(page_names)
+    except (fetch.ERRORS + (ValueError, KeyError)):
+        revisions = {}
 
+    known = store.revisions if store else {}
+    changed = [_type for _type in TYPE_NAMES
+               if revisions.get(get_page_name(_type)) is None or revisions[get_page_name(_type)] != known.get(_type)]
 
-def save_cache_to_json():
+    # Scrap changed pages concurrently, each into its own dict so they can be merged one at a time
+    progress.begin("scrapping", len(changed), "changed lists")
+    partials = [{} for _ in changed]
 
-    data = load_cache()
-    ships, types, nations = data
+    async def scrap(_type, ships):
+        await scrap_wiki_table_by_type(get_page_name(_type), ships)
+        progress.done += 1
+        print(_type + " is done.")
 
-    s = {
-        "ships": ships,
-        "types": types,
-        "nations": nations
-    }
+    await asyncio.gather(*(scrap(_type, ships) for _type, ships in zip(changed, partials)))
 
-    with open("data\\data.json", "w") as file:
-        json.dump(s, file, indent=4)
+    def merge():
+        new_store = store.copy() if store else ship_store.ShipStore({}, {}, NATIONS.values())
+        for _type, ships_of_type in zip(changed, partials):
+            new_store.replace_type(_type, ships_of_type, revisions.get(get_page_name(_type)))
+        if changed:
+            new_store.save()
+        return new_store
 
+    progress.begin("saving")
+    new_store = await asyncio.get_event_loop().run_in_executor(None, merge)
+    print("Done.")
+    return new_store, changed
 
-def scrap_wiki_table_by_type(page_name, ships):
+
+async def scrap_wiki_table_by_type(page_name, ships):
     """
     Given name of Wikipedia page with "Ships of World War II" template, scrap table for ships, and generate
         a) a list of the names of the ships belonging to the type defined by the page
@@ -130,7 +224,7 @@ def scrap_wiki_table_by_type(page_name, ships):
     and add encountered ships to the dictionary of ships.
 
     :param page_name: Str ; the title of the Wikipedia page
-    :param ships: Dict in form {ship:{property:value}}
+    :param ships: Dict in form {name: Ship}
     :return: Tuple in form (list, dict) ; dict = {nation:[ship]}
     """
 
@@ -140,34 +234,22 @@ def scrap_wiki_table_by_type(page_name, ships):
     for nation in NATIONS.values():
         nations_encountered[nation] = []
 
-    # Get soup
-    # TODO: stop using wikipedia library, it's redundant
-    data = urlopen(wikipedia.page(title=page_name).url)
-    soup = BeautifulSoup(data, "html.parser")
-    rows = soup.find("table", "wikitable").find_all("tr")
-    for row in rows:
-
-        # If row only has headers (i.e. only th cells), skip
-        if not row.find("td"):
-            continue
+    # Only the table is parsed, in a worker process; the rest of the page is skipped
+    data = await fetch.fetch_text(wiki.get_article_url(page_name))
+    rows = await parse_pool.parse_table(data)
+    for cells, link in rows:
 
         try:
-            ship = process_row(row)
+            ship = process_row(cells, link)
         except IndexError:
             # the row is incorrectly formatted
             continue
 
         # Add ship to ship dictionary
         # Todo: handle cases where field is empty; right now it just prints a blank
-        ships[ship["name"]] = {
-            "class": ship["class"],
-            "country": ship["country"],
-            "type": ship["type"],
-            "commissioned": ship["commissioned"],
-            "displacement": ship["displacement"] + " tons",
-            "fate": ship["fate"],
-            "link title": ship["link title"]
-        }
+        ships[ship["name"]] = ship_store.Ship(ship["name"], ship["class"], ship["country"], ship["type"],
+                                              ship["commissioned"], ship["displacement"] + " tons", ship["fate"],
+                                              ship["link title"])
 
         ships_of_type.append(ship["name"])
 
@@ -182,46 +264,28 @@ def scrap_wiki_table_by_type(page_name, ships):
     return ships_of_type, nations_encountered
 
 
-def process_row(row):
+def process_row(cells, link):
     """
     Extracts and prettifies row data.
-    :param row: BeautifulSoup
+    :param cells: Tuple of Str ; text of each td cell, as from wiki.get_table_rows()
+    :param link: Tuple in form (href, title) of the first link in the first cell, or NoneType
     :return: Dict
     """
 
-    columns = row.find_all("td")
-    link = columns[0].find("a")
-
     # If link exists, is not "create new page" request, and is not a section of another page,
     #   then save it. Otherwise, no link.
-    if link and "?" not in link["href"] and "#" not in link["href"]:
-        link_title = link["title"]  # Hoping the title is similar to the last part of url
-    else:
+    href, link_title = link or (None, None)  # Hoping the title is similar to the last part of url
+    if not href or "?" in href or "#" in href:
         link_title = None
 
-    # Scrap properties
-    name = columns[0].get_text()
-    country = columns[1].get_text()
-    _class = columns[2].get_text()
-    _type = columns[3].get_text()
-    displacement = columns[4].get_text()
-    commissioned = columns[5].get_text()
-    fate = columns[6].get_text().capitalize()
-
-    # Replace special unicode characters; stolen from https://stackoverflow.com/a/39612904.
-    # Still not enough to remove \u00a0 from countries, so manual it is.
-    # Todo: Observed: \u0142 (lowercase L with slash) not resolved
-    problem_strings = [name, _class, country, fate]
-    resolved_version = {name: "", _class: "", country: "", fate: ""}
-    for string in problem_strings:
-        new_string = ''.join((c for c in unicodedata.normalize('NFD', string) if unicodedata.category(c) !=
-                              'Mn')).replace("\u00a0", "")
-        resolved_version[string] = new_string
-
-    name = resolved_version[name]
-    country = resolved_version[country]
-    _class = resolved_version[_class]
-    fate = resolved_version[fate]
+    # Scrap properties; special unicode characters are replaced
+    name = text.strip_accents(cells[0])
+    country = text.strip_accents(cells[1])
+    _class = text.strip_accents(cells[2])
+    _type = cells[3]
+    displacement = cells[4]
+    commissioned = cells[5]
+    fate = text.strip_accents(cells[6].capitalize())
 
     # Modify class to remove subclasses and synonyms
     _class = _class.split("(")[0].split("=")[0].rstrip()
@@ -230,190 +294,498 @@ def process_row(row):
             "displacement": displacement, "fate": fate, "link title": link_title}
 
 
+class MoreSession:
+    """
+    What ?more still has to show one user in one channel.
+    """
+
+    __slots__ = ("paragraphs", "position", "url")
+
+    def __init__(self, paragraphs, url):
+        """
+        :param paragraphs: Tuple of Str
+        :param url: Str ; shown once the paragraphs run out
+        """
+
+        self.paragraphs = paragraphs
+        self.position = 0
+        self.url = url
+
+    def size(self):
+        """
+        :return: Int ; rough memory use in characters
+        """
+        return sum(len(paragraph) for paragraph in self.paragraphs) + len(self.url)
+
+
+def get_session_key(message):
+    """
+    :param message: discord.Message
+    :return: Tuple in form (server ID, channel ID, author ID) ; server ID is NoneType in direct messages
+    """
+
+    server = message.server.id if message.server else None
+    return server, message.channel.id, message.author.id
+
+
+class WarshipData:
+    """
+    A ship store and everything derived from it. Built whole, off the event loop, and swapped in whole, so commands
+    never see indexes from one version of the data and ships from another.
+    """
+
+    __slots__ = ("store", "query_index", "name_index", "sampler")
+
+    def __init__(self, store):
+        """
+        :param store: ShipStore ; mustn't be modified afterwards
+        """
+
+        self.store = store
+        self.query_index = ship_query.ShipQueryIndex(store)
+
+        pools = {nation: tuple(store.names_of_nation(nation)) for nation in NATIONS.values()}
+        if RANDOM_WEIGHTING == "nation":
+            weights = {nation: 1 for nation in pools}
+        else:
+            weights = {nation: len(names) for nation, names in pools.items()}
+        self.sampler = sampling.PoolSampler(pools, weights)
+        class_names = {ship.ship_class for ship in store.ships.values() if ship.ship_class}
+        self.name_index = search.NameIndex(list(store.ships) + sorted(class_names))
+
+
+def make_ship_embed(name, ship, summary, image_link, url, note):
+    """
+    :param name: Str
+    :param ship: Ship
+    :param summary: Str ; the article's first paragraph, or empty
+    :param image_link: Str ; or empty
+    :param url: Str ; the article's URL, or empty
+    :param note: Str ; why there's no summary, or empty
+    :return: discord.Embed ; the whole ?warship reply
+    """
+
+    if len(summary) > DESCRIPTION_LIMIT:
+        summary = summary[:DESCRIPTION_LIMIT - 1] + "…"
+    embed = discord.Embed(title=name, url=url, description=summary, color=EMBED_COLOR)
+    fields = (("Class", ship.ship_class),
+              ("Type", ship.ship_type.title()),
+              ("Navy", ship.country),
+              ("Displacement", ship.displacement),
+              ("Commissioned", ship.commissioned),
+              ("Fate", ship.fate.title()))  # wikipedia, why are all the months lowercase
+    for field, value in fields:
+        embed.add_field(name=field, value=value or "Unknown")  # Discord rejects empty fields
+    if image_link:
+        embed.set_image(url=image_link)
+    if note:
+        embed.set_footer(text=note)
+    return embed
+
+
 class Warship:
 
     def __init__(self, bot):
         self._bot = bot
+        self._outbox = outbox.get_outbox(bot)
+
+        self._articles = article_cache.ArticleCache(on_store=self._forget_replies)
+        self._reply_cache = cache.LRUCache(REPLY_CACHE_SIZE)
+        self._reply_names = {}  # article title: names of ships whose cached replies were built from it
+        self._data = None  # WarshipData; NoneType until loaded
+        self._loading = None  # Future of the background load, see warm_up()
+        self._load_seconds = None
+        self._refresh = None  # Future of the running or last refresh of the lists, see start_refresh()
+        self._refresh_progress = None
+        self._prefetch = None  # Future of the running or last article download, see start_prefetch()
+        self._prefetch_progress = None
+        self._prefetch_queued = False  # Whether another download is to start once the running one is done
+        self._background = None
+        self._sessions = cache.LRUCache(SESSION_LIMIT, ttl=SESSION_TTL, max_weight=SESSION_MAX_CHARS,
+                                        weigh=MoreSession.size)
+        metrics.register_cache("wikipedia articles", self._articles)
+        metrics.register_cache("warship replies", self._reply_cache)
+        metrics.register_cache("more sessions", self._sessions)
+        metrics.register_stats("warship data", lambda: {"ships": len(self._data.store) if self._data else 0,
+                                                        "load seconds": round(self._load_seconds or 0, 2)})
+        metrics.register_stats("article prefetch", self._prefetch_stats)
+
+    async def on_ready(self):
+        self.warm_up()
+
+        # on_ready fires again after reconnects
+        if self._background is None:
+            self._background = asyncio.ensure_future(self._keep_up_to_date())
+
+    def warm_up(self):
+        """
+        Starts loading the warship data in the background, generating it if there is none on disk yet.
+        Safe to call repeatedly; a load that failed is tried again.
+        :return: asyncio.Future ; done once the data is in use, or loading failed
+        """
+
+        if self._loading is None or (self._loading.done() and self._data is None):
+            self._loading = asyncio.ensure_future(self._load())
+        return self._loading
 
-        self._wikipedia_root = "https://en.wikipedia.org/wiki/"
-        self._cached = False
-        self._ship_table = {}
-        self._ship_nation_table = {}
-        self._ship_type_table = {}
-        self._generator = None
-        self._last_ship_url = ""
+    async def _load(self):
+        start = time.perf_counter()
+        try:
+            store = await get_warship_data()
+            data = await asyncio.get_event_loop().run_in_executor(None, WarshipData, store)
+        except Exception as e:
+            print("Couldn't load warship data: {e}".format(e=e))
+            return
+
+        # A refresh may have got there first
+        if self._data is None:
+            self._use(data)
+        self._load_seconds = time.perf_counter() - start
+        print("Warship data ready in {s:.2f} s.".format(s=self._load_seconds))
+
+    def _use(self, data):
+        """
+        Swap in new or updated warship data.
+        :param data: WarshipData
+        :return: NoneType
+        """
 
-    def _get_random_ship(self, table, key):
+        self._data = data
+        self._reply_cache.clear()
+        self._reply_names.clear()
+
+    def _forget_replies(self, title):
+        """
+        Drops cached replies built from an article that has just been updated.
+        :param title: Str
+        :return: NoneType
         """
-        Get random ship based on specifications.
-        If nothing specified, choose random nation then choose random ship from nation.
 
-        :param table: Str; name of table to look in (i.e. nation or type)
-        :param key: Str; which key in table to look in
-        :return: String and Dict of properties
+        for name in self._reply_names.pop(title, ()):
+            self._reply_cache.pop(name)
+
+    def start_refresh(self):
+        """
+        Starts refreshing the warship lists in the background, unless that's already happening. Once the new data is
+        in use, every ship's article is downloaded ahead of time by start_prefetch(), so ?warship doesn't have to.
+        :return: asyncio.Future of the list of types that changed, or of NoneType if the refresh failed ; done once
+            the new data is in use, without waiting for the articles
         """
 
-        choice = {}
-        choice_name = ""
+        if self._refresh is None or self._refresh.done():
+            self._refresh_progress = RefreshProgress()
+            self._refresh = asyncio.ensure_future(self._do_refresh(self._refresh_progress))
+        return self._refresh
 
-        if not table and not key:
-            nation = random.choice(list(NATIONS.values()))
-            ships_of_nation = self._ship_nation_table[nation]
-            choice_name = random.choice(ships_of_nation)
-            choice = self._ship_table[choice_name]
+    async def _do_refresh(self, progress):
+        """
+        :param progress: RefreshProgress
+        :return: List of types that changed, or NoneType if the refresh failed
+        """
 
-        if table == "nation":
-            ships_of_nation = self._ship_nation_table[key]
-            choice_name = random.choice(ships_of_nation)
-            choice = self._ship_table[choice_name]
-        elif table == "type":
-            ships_of_type = self._ship_type_table[key]
-            choice_name = random.choice(ships_of_type)
-            choice = self._ship_table[choice_name]
+        if self._data is None:
+            await asyncio.shield(self.warm_up())
+        try:
+            store, changed = await generate_warship_cache(self._data.store if self._data else None, progress)
+            if changed or self._data is None:
+                progress.begin("indexing")
+                self._use(await asyncio.get_event_loop().run_in_executor(None, WarshipData, store))
+        except Exception as e:
+            print("Couldn't refresh warship data: {e}".format(e=e))
+            return None
+
+        self.start_prefetch()
+        return changed
+
+    def start_prefetch(self):
+        """
+        Starts downloading the articles of every ship in use that are missing or stale, unless that's already
+        happening, in which case another download starts once it's done, for ships that came in meanwhile.
+        :return: asyncio.Future of NoneType ; done once the articles are downloaded
+        """
 
-        return choice_name, choice
+        if self._prefetch is None or self._prefetch.done():
+            self._prefetch_progress = RefreshProgress()
+            self._prefetch = asyncio.ensure_future(self._do_prefetch(self._prefetch_progress))
+        elif not self._prefetch_queued:
+            self._prefetch = asyncio.ensure_future(self._prefetch_after(self._prefetch))
+            self._prefetch_queued = True
+        return self._prefetch
 
-    def _get_ship(self, name):
+    async def _prefetch_after(self, previous):
         """
-        Get ship by name.
-        :param name: String
-        :return: Dict of ship properties.
+        :param previous: asyncio.Future of a running download
+        :return: NoneType
         """
-        # Todo: Implement fuzzy searching (e.g. Search for 'Bismark' failed. Did you mean 'Bismarck'?)
-        try:
-            ship = self._ship_table[name]
-        except KeyError:
+
+        await asyncio.wait([previous])
+        self._prefetch_queued = False
+        self._prefetch_progress = RefreshProgress()
+        await self._do_prefetch(self._prefetch_progress)
+
+    async def _do_prefetch(self, progress):
+        """
+        :param progress: RefreshProgress
+        :return: NoneType
+        """
+
+        if self._data is None:
+            return
+
+        # Ships keep being looked up from the data in use meanwhile
+        progress.begin("downloading articles", unit="articles")
+        titles = [ship.link_title for ship in self._data.store.ships.values() if ship.link_title]
+        downloaded, failed = await self._articles.prefetch(titles, ENRICH_CONCURRENCY, progress.advance)
+        if downloaded or failed:
+            print("Downloaded {n} articles; {failed} failed.".format(n=downloaded, failed=failed))
+
+    def _prefetch_stats(self):
+        """
+        :return: Dict of numbers ; empty unless articles are being downloaded
+        """
+
+        if self._prefetch is None or self._prefetch.done():
             return {}
+        return {"done": self._prefetch_progress.done, "total": self._prefetch_progress.total}
+
+    async def _keep_up_to_date(self):
+        """
+        Downloads articles an earlier run didn't get to, then refreshes every REFRESH_INTERVAL seconds if set.
+        :return: NoneType ; runs until cancelled
+        """
+
+        await asyncio.shield(self.warm_up())
+        scrap_lists = False
+        while True:
+            # One run failing mustn't end the schedule
+            try:
+                if scrap_lists or self._data is None:
+                    await asyncio.shield(self.start_refresh())
+                else:
+                    await asyncio.shield(self.start_prefetch())
+            except Exception as e:
+                print("Scheduled refresh failed: {e}".format(e=e))
+            if not REFRESH_INTERVAL:
+                return
+            await asyncio.sleep(REFRESH_INTERVAL)
+            scrap_lists = True
+
+    def _revalidate_in_background(self, title):
+        """
+        :param title: Str ; of an article that has gone stale
+        :return: NoneType
+        """
+
+        async def revalidate():
+            try:
+                await self._articles.get_article(title)
+            except Exception:
+                pass  # Stays stale, and is tried again next time it's shown
+
+        asyncio.ensure_future(revalidate())
+
+    def _get_random_ship(self, filters, channel=None):
+        """
+        Get random ship based on specifications, without repeats in a channel until every match has been shown.
+        If nothing specified, choose a weighted random nation then choose random ship from nation.
+
+        :param filters: Dict of ShipQueryIndex.query() keyword arguments
+        :param channel: Str or NoneType ; ID of the channel asking
+        :return: String and Ship; NoneType ship if nothing matches
+        """
+
+        data = self._data
+        if not filters:
+            choice_name = data.sampler.draw_weighted(channel)
         else:
-            return ship
+            ships = data.query_index.query(**filters)
+            choice_name = data.sampler.draw(tuple(sorted(filters.items())), ships, channel)
+
+        if choice_name is None:
+            return "", None
+        return choice_name, data.store.get(choice_name)
+
+    def _get_ship(self, name):
+        """
+        Get ship by name, or a random ship of the class if a class is named instead. Case doesn't matter.
+        :param name: String
+        :return: String and Ship, or NoneType if there's no such ship
+        """
+
+        data = self._data
+        ship = data.store.get(name)
+        if ship:
+            return name, ship
+
+        # e.g. "prince of wales" for "Prince of Wales", which title-casing would miss
+        name = data.name_index.find(name) or name
+        ship = data.store.get(name)
+        if ship:
+            return name, ship
 
-    def _generate_ship_reply(self, name, ship):
+        ships_of_class = data.query_index.query(_class=name)
+        if ships_of_class:
+            choice_name = random.choice(ships_of_class)
+            return choice_name, data.store.get(choice_name)
+
+        return name, None
+
+    async def _generate_ship_reply(self, name, ship, guild=None):
         """
-        Create discord response.
+        Create discord response, reusing the rendered one if the ship was asked for recently.
         :param name: String, name of the ship
-        :param ship: Dict, properties of the ship
-        :return: Two strings: one for text blurb, one for image url
+        :param ship: Ship
+        :param guild: String or NoneType ; ID of the server asking, which takes its turn if Wikipedia has to be called
+        :raises ratelimit.Busy: if Wikipedia has to be called and the server has used up its share for now
+        :return: Tuple in form (embed, more paragraphs, article url) ; paragraphs is a Tuple of Str, and the URL is a
+            note saying why there's no article if there isn't one
         """
 
+        reply = self._reply_cache.get(name)
+        if reply is not None:
+            return reply
+
         image_link = ""
+        summary = ""
+        paragraphs = ()
+        url = ""
+        note = ""
+        cacheable = True
 
         # Get summary if page exists
-        if ship["link title"]:
+        if ship.link_title:
 
-            title = ship["link title"]
+            title = ship.link_title
 
-            # Try to get summary and image via wikipedia.py
-            try:
-                page = wikipedia.page(title=title)
-                raw_summary = page.summary
-                image_link = wiki.get_article_first_image(title)
+            # Refreshes download every article ahead of time; one that's gone stale is still shown meanwhile
+            cached = self._articles.get_cached(title)
+            if cached is not None:
+                article, fresh = cached
+                if not fresh:
+                    self._revalidate_in_background(title)
+                    cacheable = False  # Built again once revalidated, in case the article changed
+            else:
+                await ratelimit.limiter.admit("wikipedia", guild)
 
-            # If page load fails, do it yourself
-            except wikipedia.exceptions.PageError:
-                raw_summary = wiki.get_article_summary(title)
-                image_link = wiki.get_article_first_image(title)
+                # One download gives the summary, image, and URL
+                try:
+                    article = await self._articles.get_article(title)
+                except Exception:
+                    article = None  # Not just downloads; a page that won't parse or store shouldn't lose the reply
 
-            # Set generator so that paragraphs can be yielded if called by self.more()
-            self._generator = text_manipulation.text_generator(raw_summary)
-            summary = "\n\n" + next(self._generator)
-            self._last_ship_url = self._wikipedia_root + title.replace(" ", "_")
+            if article is None:
+                note = "Couldn't load the Wikipedia article for this ship."
+                cacheable = False  # Try again next time
+            else:
+                image_link = article.image_url
+                summary = article.paragraphs[0] if article.paragraphs else ""
+                paragraphs = tuple(article.paragraphs[1:])  # Saved for self.more()
+                url = article.url
 
         else:
-            summary = ""
-            self._last_ship_url = "No Wikipedia article for this ship exists."
-
-        blurb = "Name: {name}\n" \
-                "Class: {_class}\n" \
-                "Type: {ship_type}\n" \
-                "Navy: {navy}\n" \
-                "Displacement: {displacement}\n" \
-                "Commissioned: {commissioned}\n" \
-                "Fate: {fate}" \
-                "{summary}".format(name=name,
-                                   _class=ship["class"],
-                                   ship_type=ship["type"].title(),
-                                   navy=ship["country"],
-                                   displacement=ship["displacement"],
-                                   commissioned=ship["commissioned"],
-                                   fate=ship["fate"].title(),  # wikipedia, why are all the months lowercase
-                                   summary=summary)
-
-        return blurb, image_link
-
-    @commands.command()
-    async def warship(self, *, str_args: str = ""):
+            note = "No Wikipedia article for this ship exists."
+
+        reply = (make_ship_embed(name, ship, summary, image_link, url, note), paragraphs, url or note)
+
+        # Not if the data was refreshed meanwhile and the ship has changed
+        if cacheable and self._data.store.get(name) is ship:
+            self._reply_cache.put(name, reply)
+            if ship.link_title:
+                self._reply_names.setdefault(ship.link_title, set()).add(name)
+        return reply
+
+    @commands.command(pass_context=True)
+    async def warship(self, context, *, str_args: str = ""):
         """
         Gets a random WW2-era warship via Wikipedia.
         Under construction.
-        -s to search by hull type or country.
+        Filter with any of -n nation, -t hull type, -c class, -f fate, -y years, -d displacement.
         """
 
-        ship = {}
+        ship = None
         name = ""
         arg_error = False
 
-        # Get cache if don't have it yet
-        if not self._cached:
-            self._ship_table, self._ship_type_table, self._ship_nation_table = get_warship_data()
-
-        args = str_args.split(" ")
-        if not str_args:
-            name, ship = self._get_random_ship(table="", key="")
+        # Data loads in the background after login; wait a little for it rather than turning people away at once
+        if self._data is None:
+            try:
+                await asyncio.wait_for(asyncio.shield(self.warm_up()), LOADING_WAIT)
+            except asyncio.TimeoutError:
+                pass
+            if self._data is None:
+                await self._outbox.send(context.message.channel, LOADING_REPLY)
+                return
+
+        channel = context.message.channel
+        args = str_args.split()
+        if not args:
+            name, ship = self._get_random_ship({}, channel.id)
         else:
-            if args[0] == "-n":
-                try:
-                    nation = NATIONS[args[1].lower()]
-                except KeyError:
-                    arg_error = True
-                else:
-                    name, ship = self._get_random_ship(table="nation", key=nation)
-            elif args[0] == "-t":
+            if args[0] in FILTER_FLAGS:
                 try:
-                    _type = HULL_TYPES[args[1].lower()]
-                except KeyError:
+                    filters = parse_filters(args)
+                except ValueError:
                     arg_error = True
                 else:
-                    name, ship = self._get_random_ship(table="type", key=_type)
+                    name, ship = self._get_random_ship(filters, channel.id)
             else:
                 if "-" in args[0]:
                     # Avoid searching if obvious typo present
                     arg_error = True
                 else:
-                    name = " ".join(args).title()
-                    ship = self._get_ship(name)
+                    name, ship = self._get_ship(" ".join(args))
 
         if arg_error:
-            await self._bot.say("Invalid specification. Try again.")
+            await self._outbox.send(channel, "Invalid specification. Try again.")
         else:
             if ship:
                 # If no ship by now, user entered something wrong
-                text, image_link = self._generate_ship_reply(name, ship)
-                await self._bot.say("```\n" + text + "\n```")
-                if image_link:
-                    await self._bot.say(image_link)
-            else:
-                await self._bot.say("No warship was found. Check arguments and/or spelling.")
-
-    @commands.command()
-    async def more(self):
-        """Gets more information from the last ?warship call."""
-        try:
-            reply = "```\n" + next(self._generator) + "\n```"
-        except (StopIteration, TypeError):
-            if self._last_ship_url:
-                reply = "Read more online!\n\n" + self._last_ship_url
+                key = get_session_key(context.message)
+                try:
+                    embed, paragraphs, url = await self._generate_ship_reply(name, ship, key[0])
+                except ratelimit.Busy:
+                    await self._outbox.send(channel, ratelimit.BUSY_REPLY)
+                    return
+                self._sessions.put(key, MoreSession(paragraphs, url))
+                await self._outbox.send(channel, embed=embed)
             else:
-                reply = "A warship was not previously generated, so there's nothing to get."
-        await self._bot.say(reply)
-
-    @commands.command()
-    async def refresh(self):
-        """Re-fetches cached data. Use sparingly."""
-        self._ship_table, self._ship_type_table, self._ship_nation_table = generate_warship_cache()
-        await self._bot.say("Data refreshed.")
-
-    @commands.command()
-    async def json(self):
-        """For debugging."""
-        save_cache_to_json()
-        await self._bot.say("Data saved to JSON file.")
+                suggestions = self._data.name_index.suggest(name) if name else []
+                if suggestions:
+                    await self._outbox.send(channel, "No warship was found. Did you mean {names}?".format(
+                        names=" or ".join("'{}'".format(suggestion) for suggestion in suggestions)))
+                else:
+                    await self._outbox.send(channel, "No warship was found. Check arguments and/or spelling.")
+
+    @commands.command(pass_context=True)
+    async def more(self, context):
+        """Gets more information from your last ?warship call in this channel."""
+        key = get_session_key(context.message)
+        session = self._sessions.get(key)
+        if session is None:
+            reply = "A warship was not previously generated, so there's nothing to get."
+        elif session.position < len(session.paragraphs):
+            reply = text.codeblock(session.paragraphs[session.position])
+            session.position += 1
+            self._sessions.put(key, session)  # Restart its TTL
+        else:
+            reply = "Read more online!\n\n" + session.url
+        await self._outbox.send(context.message.channel, reply)
+
+    @commands.command(pass_context=True)
+    async def refresh(self, context):
+        """Re-fetches cached data in the background. Use sparingly."""
+
+        channel = context.message.channel
+        if self._refresh is not None and not self._refresh.done():
+            await self._outbox.send(channel, "Already refreshing. " + self._refresh_progress.describe())
+            return
+
+        await self._outbox.send(channel, "Refreshing in the background; warships can still be looked up meanwhile.")
+        changed = await asyncio.shield(self.start_refresh())
+        if changed is None:
+            await self._outbox.send(channel, "Refresh failed; still using the data from before.")
+        elif changed:
+            await self._outbox.send(channel, "Data refreshed; {n} of {total} lists had changed.".format(
+                n=len(changed), total=len(TYPE_NAMES)))
+        else:
+            await self._outbox.send(channel, "Data is already up to date.")
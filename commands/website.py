@@ -2,40 +2,159 @@
 Commands that involving scrapping one specific website, and their related functions.
 """
 
+import asyncio
 import random
+import time
 from discord.ext import commands
 import os
-import praw
+
+from helpers import cache, metrics, outbox, ratelimit, singleflight
+
+LISTING_SIZE = 50  # Hot submissions kept per subreddit
+LISTING_FRESH = int(os.environ.get("REDDIT_LISTING_FRESH", 5 * 60))  # Seconds before a background refresh
+LISTING_MAX_AGE = int(os.environ.get("REDDIT_LISTING_MAX_AGE", 60 * 60))  # Seconds before it's too old to serve
+SUBREDDIT_LIMIT = int(os.environ.get("REDDIT_SUBREDDIT_LIMIT", 200))  # Subreddits held at once
+
+
+class Listing:
+    """
+    A subreddit's hot submissions as of one fetch.
+    """
+
+    __slots__ = ("posts", "fetched")
+
+    def __init__(self, posts):
+        """
+        :param posts: Tuple of (title, url) tuples
+        """
+
+        self.posts = posts
+        self.fetched = time.monotonic()
+
+    def age(self):
+        return time.monotonic() - self.fetched
+
+
+def should_retry(error):
+    """
+    :param error: Exception raised by PRAW
+    :return: Bool ; whether it's worth trying again after backing off
+    """
+
+    response = getattr(error, "response", None)
+    return response is not None and ratelimit.is_retryable_status(getattr(response, "status_code", 0))
 
 
 class Website:
 
     def __init__(self, bot):
         self._bot = bot
+        self._outbox = outbox.get_outbox(bot)
         self._reddit = None
+        self._listings = cache.LRUCache(SUBREDDIT_LIMIT, ttl=LISTING_MAX_AGE)
+        self._refreshing = set()
+        metrics.register_cache("subreddit listings", self._listings)
+
+    def _fetch_hot(self, subreddit):
+        """
+        Blocking; run it in an executor.
+        :param subreddit: Str
+        :return: Listing
+        """
+
+        posts = tuple((post.title, post.url) for post in self._reddit.subreddit(subreddit).hot(limit=LISTING_SIZE))
+        return Listing(posts)
+
+    async def _load_listing(self, subreddit):
+        """
+        Fetch a listing, sharing the fetch with anyone else asking for the same subreddit meanwhile.
+        :param subreddit: Str ; lowercase
+        :return: Listing
+        """
+        return await singleflight.group.do(("reddit", subreddit), lambda: self._fetch_listing(subreddit))
+
+    async def _fetch_listing(self, subreddit):
+        """
+        :param subreddit: Str ; lowercase
+        :return: Listing
+        """
+
+        loop = asyncio.get_event_loop()
+
+        async def attempt():
+            await ratelimit.limiter.acquire("reddit")
+            with metrics.timed_call("reddit"):
+                return await loop.run_in_executor(None, self._fetch_hot, subreddit)
+
+        listing = await ratelimit.with_backoff(attempt, should_retry)
+        self._listings.put(subreddit, listing)
+        return listing
+
+    async def _refresh_in_background(self, subreddit):
+        """
+        :param subreddit: Str ; lowercase
+        :return: NoneType
+        """
+
+        try:
+            await self._load_listing(subreddit)
+        except Exception as e:
+            # The stale listing keeps being served until it's too old
+            print("Background refresh of r/{sub} failed: {e}".format(sub=subreddit, e=e))
+        finally:
+            self._refreshing.discard(subreddit)
 
-    @commands.command()
-    async def reddit(self, subreddit):
+    async def _get_listing(self, subreddit, guild):
+        """
+        Serve the cached listing, refreshing it in the background once it's no longer fresh.
+        :param subreddit: Str
+        :param guild: Str or NoneType ; ID of the server asking, which takes its turn if Reddit has to be called
+        :raises ratelimit.Busy: if the listing isn't cached and the rate limit would take too long to clear
+        :return: Listing
+        """
+
+        subreddit = subreddit.lower()
+        listing = self._listings.get(subreddit)
+        if listing is None:
+            await ratelimit.limiter.admit("reddit", guild)
+            return await self._load_listing(subreddit)
+
+        if listing.age() >= LISTING_FRESH and subreddit not in self._refreshing:
+            self._refreshing.add(subreddit)
+            asyncio.ensure_future(self._refresh_in_background(subreddit))
+        return listing
+
+    @commands.command(pass_context=True)
+    async def reddit(self, context, subreddit):
         """
         Gets a random hot submission from any subreddit.
         Ex. ?reddit android
         """
 
-        # Set reddit client once
+        # Set reddit client once; PRAW is slow to import, so that waits until it's needed
         if not self._reddit:
+            import praw
             try:
                 self._reddit = praw.Reddit(client_id=os.environ["REDDIT_CLIENT_ID"],
                                            client_secret=os.environ["REDDIT_CLIENT_SECRET"],
                                            user_agent=os.environ["REDDIT_USER_AGENT"])
             except:
-                await self._bot.say("Reddit authorization failed.")
+                await self._outbox.send(context.message.channel, "Reddit authorization failed.")
                 return
 
+        server = context.message.server
+        try:
+            listing = await self._get_listing(subreddit, server.id if server else None)
+        except ratelimit.Busy:
+            await self._outbox.send(context.message.channel, ratelimit.BUSY_REPLY)
+            return
+        except Exception:
+            await self._outbox.send(context.message.channel, "Couldn't load r/{sub}.".format(sub=subreddit))
+            return
+
         # Get random submission within limit
-        limit = 50
-        i = random.randrange(limit)
-        for idx, post in enumerate(self._reddit.subreddit(subreddit).hot(limit=50)):
-            if idx == i:
-                reply = post.title + "\n" + post.url
-                await self._bot.say(reply)
-                break
+        if listing.posts:
+            title, url = listing.posts[random.randrange(len(listing.posts))]
+            await self._outbox.send(context.message.channel, title + "\n" + url)
+        else:
+            await self._outbox.send(context.message.channel, "r/{sub} has no hot submissions.".format(sub=subreddit))
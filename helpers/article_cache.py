@@ -0,0 +1,217 @@
+"""
+Disk-backed cache of parsed Wikipedia articles, revalidated with ETag/Last-Modified once they go stale.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import time
+
+from helpers import fetch, parse_pool, singleflight, wiki
+
+DEFAULT_PATH = os.path.join("data", "articles.sqlite")
+DEFAULT_TTL = int(os.environ.get("ARTICLE_CACHE_TTL", 7 * 24 * 60 * 60))  # Seconds
+PREFETCH_CONCURRENCY = 4  # Downloads in flight at once while prefetching
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS articles (
+    title TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    paragraphs TEXT NOT NULL,
+    image_url TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    checked_at REAL NOT NULL
+)
+"""
+
+
+class ArticleCache:
+
+    def __init__(self, path=DEFAULT_PATH, ttl=DEFAULT_TTL, on_store=None):
+        """
+        :param path: Str
+        :param ttl: Number ; seconds before an article is revalidated
+        :param on_store: Function taking a title, called whenever a new version of that article is stored, or NoneType
+        """
+
+        self._ttl = ttl
+        self._on_store = on_store
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.execute(_SCHEMA)
+        self._db.commit()
+
+    def lookup(self, title):
+        """
+        Get a cached article without touching the network.
+        :param title: Str
+        :return: Tuple in form (Article, Bool) where the Bool is whether it's still fresh, or NoneType
+        """
+
+        row = self._db.execute("SELECT url, paragraphs, image_url, checked_at FROM articles WHERE title = ?",
+                               (title,)).fetchone()
+        if row is None:
+            return None
+        url, paragraphs, image_url, checked_at = row
+        article = wiki.Article(title, url, json.loads(paragraphs), image_url)
+        return article, time.time() - checked_at < self._ttl
+
+    def get_cached(self, title):
+        """
+        Get a cached article however old it is, counting it as a hit if there is one.
+        :param title: Str
+        :return: Tuple in form (Article, Bool) where the Bool is whether it's still fresh, or NoneType
+        """
+
+        cached = self.lookup(title)
+        if cached is not None:
+            self.hits += 1
+        return cached
+
+    def store(self, article, etag=None, last_modified=None):
+        """
+        :param article: wiki.Article
+        :param etag: Str or NoneType
+        :param last_modified: Str or NoneType
+        :return: NoneType
+        """
+
+        self._db.execute("INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         (article.title, article.url, json.dumps(article.paragraphs), article.image_url,
+                          etag, last_modified, time.time()))
+        self._db.commit()
+        if self._on_store:
+            self._on_store(article.title)
+
+    def _mark_checked(self, title):
+        self._db.execute("UPDATE articles SET checked_at = ? WHERE title = ?", (time.time(), title))
+        self._db.commit()
+
+    def _validators(self, title):
+        """
+        :param title: Str
+        :return: Dict of conditional request headers
+        """
+
+        row = self._db.execute("SELECT etag, last_modified FROM articles WHERE title = ?", (title,)).fetchone()
+        headers = {}
+        if row:
+            etag, last_modified = row
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        return headers
+
+    async def get_article(self, title):
+        """
+        Get an article, serving it locally while fresh and revalidating it once stale.
+        :param title: Str
+        :return: wiki.Article
+        """
+
+        cached = self.lookup(title)
+        if cached and cached[1]:
+            self.hits += 1
+            return cached[0]
+        self.misses += 1
+        return await self._download(title, cached)
+
+    async def _download(self, title, cached):
+        """
+        :param title: Str
+        :param cached: Tuple in form (Article, Bool) from lookup(), or NoneType
+        :return: wiki.Article
+        """
+
+        # Everyone asking while it's being fetched waits for the same download
+        return await singleflight.group.do(("wikipedia", title), lambda: self._fetch(title, cached))
+
+    async def _fetch(self, title, cached):
+        """
+        :param title: Str
+        :param cached: Tuple in form (Article, Bool) from lookup(), or NoneType
+        :return: wiki.Article
+        """
+
+        headers = self._validators(title) if cached else {}
+        try:
+            resp = await fetch.request(wiki.get_article_url(title), headers=headers)
+        except fetch.ERRORS:
+            # A stale article beats no article
+            if cached:
+                return cached[0]
+            raise
+
+        # Unchanged upstream; keep what we have for another TTL
+        if resp.status == 304 and cached:
+            self.revalidations += 1
+            self._mark_checked(title)
+            return cached[0]
+
+        if resp.status >= 400:
+            if cached:
+                return cached[0]
+            raise fetch.FetchError(resp.url, resp.status)
+
+        article = await parse_pool.parse_article(title, resp.text)
+        self.store(article, resp.headers.get("ETag"), resp.headers.get("Last-Modified"))
+        return article
+
+    def fresh_titles(self):
+        """
+        :return: Set of Str ; titles of every article that doesn't need revalidating yet
+        """
+
+        rows = self._db.execute("SELECT title FROM articles WHERE checked_at > ?", (time.time() - self._ttl,))
+        return {title for title, in rows}
+
+    async def prefetch(self, titles, concurrency=PREFETCH_CONCURRENCY, progress=None):
+        """
+        Downloads every article that isn't cached or has gone stale, a few at a time. Each is stored as soon as it
+        arrives, so an interrupted prefetch carries on from where it stopped next time.
+        :param titles: Iterable of Str
+        :param concurrency: Int ; downloads in flight at once
+        :param progress: Function taking (done, total) after each article, or NoneType
+        :return: Tuple in form (downloaded, failed) ; failed articles are tried again next time
+        """
+
+        fresh = self.fresh_titles()
+        pending = [title for title in dict.fromkeys(titles) if title not in fresh]
+        counts = {"done": 0, "failed": 0}
+        remaining = iter(pending)
+
+        # Workers share one iterator, so no more than concurrency downloads are ever waiting on the rate limit
+        async def work():
+            for title in remaining:
+                try:
+                    await self._download(title, self.lookup(title))  # Not counted as hits or misses
+                except Exception:
+                    # Not just downloads; an article that won't parse or store mustn't stop the rest
+                    counts["failed"] += 1
+                counts["done"] += 1
+                if progress:
+                    progress(counts["done"], len(pending))
+
+        await asyncio.gather(*(work() for _ in range(min(concurrency, len(pending)))))
+        return counts["done"] - counts["failed"], counts["failed"]
+
+    def stats(self):
+        """
+        :return: Dict ; misses include stale articles, some of which revalidate without a full download
+        """
+
+        lookups = self.hits + self.misses
+        size = self._db.execute("SELECT COUNT(*) FROM articles").fetchone()[0]
+        return {"size": size, "hits": self.hits, "misses": self.misses, "revalidations": self.revalidations,
+                "hit ratio": self.hits / lookups if lookups else 0.0}
+
+    def close(self):
+        self._db.close()
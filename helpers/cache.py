@@ -0,0 +1,119 @@
+"""
+Small in-memory caches shared by the commands.
+"""
+
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Bounded mapping that evicts the least recently used entry once full, and counts its hits and misses.
+    Entries can also expire after a TTL, and the total weight of the entries (e.g. their size) can be capped.
+    """
+
+    def __init__(self, maxsize, ttl=None, max_weight=None, weigh=None):
+        """
+        :param maxsize: Int ; most entries held
+        :param ttl: Number or NoneType ; seconds an entry lives after it's put
+        :param max_weight: Number or NoneType ; most total weight held
+        :param weigh: Function taking a value and returning its weight ; needed with max_weight
+        """
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_weight = max_weight
+        self._weigh = weigh
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._data = OrderedDict()  # key: (value, expiry time, weight)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """
+        :param key: Hashable
+        :param default: Object ; returned on a miss
+        :return: Object
+        """
+
+        try:
+            value, expires, _ = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        if expires is not None and expires <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """
+        Adds or replaces an entry, restarting its TTL.
+        :param key: Hashable
+        :param value: Object
+        :return: NoneType
+        """
+
+        if self.maxsize <= 0:
+            return
+        if key in self._data:
+            self._remove(key)
+
+        weight = self._weigh(value) if self._weigh else 0
+        if self.max_weight is not None and weight > self.max_weight:
+            self.evictions += 1  # Would push out everything else and still not fit
+            return
+
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        self._data[key] = (value, expires, weight)
+        self.weight += weight
+        while len(self._data) > self.maxsize or (self.max_weight is not None and self.weight > self.max_weight):
+            self._remove(next(iter(self._data)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        _, _, weight = self._data.pop(key)
+        self.weight -= weight
+
+    def pop(self, key, default=None):
+        if key not in self._data:
+            return default
+        value = self._data[key][0]
+        self._remove(key)
+        return value
+
+    def items(self):
+        """
+        :return: List of (key, value) tuples, least recently used first; expired entries included
+        """
+        return [(key, entry[0]) for key, entry in self._data.items()]
+
+    def clear(self):
+        self._data.clear()
+        self.weight = 0
+
+    def stats(self):
+        """
+        :return: Dict
+        """
+
+        lookups = self.hits + self.misses
+        stats = {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses,
+                 "hit ratio": self.hits / lookups if lookups else 0.0, "evictions": self.evictions,
+                 "expirations": self.expirations}
+        if self.max_weight is not None:
+            stats["weight"] = self.weight
+            stats["max weight"] = self.max_weight
+        return stats
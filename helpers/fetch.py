@@ -0,0 +1,142 @@
+"""
+Shared non-blocking HTTP layer for scrapping, so that slow pages never stall the event loop.
+"""
+
+import asyncio
+import inspect
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from helpers import metrics, ratelimit
+
+USER_AGENT = "Plasma Discord bot (https://github.com/anticobalt/Plasma)"
+POOL_SIZE = 20  # Total keep-alive connections shared by every cog
+PER_HOST_LIMIT = 4  # Concurrent requests to any one host
+TIMEOUT = 15  # Seconds for one full request, including reading the body
+
+SERVICES_BY_HOST = {"en.wikipedia.org": "wikipedia"}  # Hosts whose requests are rate limited, see ratelimit
+
+Response = namedtuple("Response", ["status", "headers", "text", "url"])
+
+_session = None
+_host_semaphores = {}
+
+
+class FetchError(Exception):
+
+    def __init__(self, url, status, retry_after=None):
+        super().__init__("GET {url} returned HTTP {status}".format(url=url, status=status))
+        self.url = url
+        self.status = status
+        self.retry_after = retry_after
+
+
+# Everything a failed fetch can raise, for callers that want to degrade gracefully
+ERRORS = (FetchError, asyncio.TimeoutError, aiohttp.ClientError, ratelimit.Busy)
+
+
+def get_session():
+    """
+    Returns the shared client session, creating it (and its connection pool) on first use.
+    :return: aiohttp.ClientSession
+    """
+
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=POOL_SIZE)
+        _session = aiohttp.ClientSession(connector=connector, headers={"User-Agent": USER_AGENT})
+    return _session
+
+
+def _get_host_semaphore(url):
+    """
+    :param url: Str
+    :return: asyncio.Semaphore
+    """
+
+    host = urlsplit(url).netloc
+    if host not in _host_semaphores:
+        _host_semaphores[host] = asyncio.Semaphore(PER_HOST_LIMIT)
+    return _host_semaphores[host]
+
+
+async def _get(url, headers):
+    """
+    :param url: Str
+    :param headers: Dict or NoneType
+    :return: Response
+    """
+
+    async with get_session().get(url, headers=headers) as resp:
+        text = await resp.text()
+        return Response(resp.status, resp.headers, text, str(resp.url))
+
+
+def _should_retry(error):
+    """
+    :param error: Exception
+    :return: Bool or Number ; see ratelimit.with_backoff()
+    """
+
+    if isinstance(error, FetchError) and ratelimit.is_retryable_status(error.status):
+        return error.retry_after or True
+    return False
+
+
+async def request(url, headers=None, timeout=TIMEOUT):
+    """
+    GETs a URL through the shared pool, waiting for the host's rate limit and a free slot on the host first.
+    429s and 5xxs are retried with backoff.
+    :param url: Str
+    :param headers: Dict or NoneType ; extra request headers
+    :param timeout: Number ; seconds
+    :raises FetchError: if the response is still a 429 or 5xx after retrying
+    :raises ratelimit.Busy: if the host's rate limit would take too long to clear
+    :return: Response
+    """
+
+    service = SERVICES_BY_HOST.get(urlsplit(url).netloc)
+
+    async def attempt():
+        if service:
+            await ratelimit.limiter.acquire(service)
+        async with _get_host_semaphore(url):
+            with metrics.timed_call(service or urlsplit(url).netloc) as fail:
+                resp = await asyncio.wait_for(_get(url, headers), timeout)
+                if ratelimit.is_retryable_status(resp.status):
+                    raise FetchError(url, resp.status, ratelimit.parse_retry_after(resp.headers))
+                if resp.status >= 400:
+                    fail()
+        return resp
+
+    return await ratelimit.with_backoff(attempt, _should_retry)
+
+
+async def fetch_text(url, timeout=TIMEOUT):
+    """
+    GETs a URL and returns its body, raising on HTTP errors.
+    :param url: Str
+    :param timeout: Number ; seconds
+    :return: Str
+    """
+
+    resp = await request(url, timeout=timeout)
+    if resp.status >= 400:
+        raise FetchError(url, resp.status)
+    return resp.text
+
+
+async def close():
+    """
+    Closes the shared session. Safe to call if it was never opened.
+    :return: NoneType
+    """
+
+    global _session
+    if _session is not None and not _session.closed:
+        result = _session.close()  # Coroutine in newer aiohttp, plain call in older ones
+        if inspect.isawaitable(result):
+            await result
+    _session = None
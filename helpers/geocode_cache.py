@@ -0,0 +1,113 @@
+"""
+Cache of geocoded addresses, so the same place is only ever paid for once.
+"""
+
+import asyncio
+import json
+import os
+import re
+from collections import namedtuple
+
+from helpers import cache
+
+DEFAULT_PATH = os.environ.get("GEOCODE_CACHE_PATH", os.path.join("data", "geocode.json"))  # Empty to disable
+DEFAULT_SIZE = int(os.environ.get("GEOCODE_CACHE_SIZE", 2000))
+SAVE_DELAY = float(os.environ.get("GEOCODE_CACHE_SAVE_DELAY", 30))  # Seconds new entries wait, to be written together
+
+Place = namedtuple("Place", ["lat", "lng", "address"])
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+
+
+def normalize_address(text):
+    """
+    Case, whitespace, and punctuation don't change where an address is.
+    :param text: Str ; e.g. "123 Main St., Center City"
+    :return: Str ; e.g. "123 main st center city"
+    """
+    return " ".join(_PUNCTUATION.sub(" ", text.lower()).split())
+
+
+class GeocodeCache:
+
+    def __init__(self, maxsize=DEFAULT_SIZE, path=DEFAULT_PATH, save_delay=SAVE_DELAY):
+        """
+        :param maxsize: Int
+        :param path: Str or NoneType ; JSON file to persist to; nothing is saved if falsy
+        :param save_delay: Number ; seconds
+        """
+
+        self._places = cache.LRUCache(maxsize)
+        self._path = path
+        self._save_delay = save_delay
+        self._dirty = False  # Entries were added since the file was last written
+        self._saving = None  # Future writing the file; only while it's running
+        if path:
+            self._load()
+
+    def stats(self):
+        return self._places.stats()
+
+    def get(self, address):
+        """
+        :param address: Str ; as the user typed it
+        :return: Place or NoneType
+        """
+        return self._places.get(normalize_address(address))
+
+    def put(self, address, place):
+        """
+        :param address: Str ; as the user typed it
+        :param place: Place
+        :return: NoneType
+        """
+
+        self._places.put(normalize_address(address), place)
+        if self._path and not self._dirty:
+            self._dirty = True
+            asyncio.get_event_loop().call_later(self._save_delay, self._start_save)
+
+    def _load(self):
+        try:
+            with open(self._path, encoding="utf-8") as file:
+                entries = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return
+        for key, place in entries:
+            self._places.put(key, Place(*place))
+
+    def _start_save(self):
+        if self._saving is None:
+            self._saving = asyncio.ensure_future(self._save())
+
+    async def _save(self):
+        """
+        Writes the file in an executor, again if more entries came in meanwhile.
+        :return: NoneType
+        """
+
+        try:
+            while self._dirty:
+                self._dirty = False
+                entries = [[key, list(place)] for key, place in self._places.items()]
+                try:
+                    await asyncio.get_event_loop().run_in_executor(None, self._write, entries)
+                except OSError as e:
+                    print("Couldn't write geocodes to {path}: {e}".format(path=self._path, e=e))
+        finally:
+            self._saving = None
+
+    def _write(self, entries):
+        """
+        :param entries: List in form [[key, place as a List], ...] ; least recently used first, so reloading keeps the
+        same eviction order
+        :return: NoneType
+        """
+
+        directory = os.path.dirname(self._path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = self._path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(entries, file, ensure_ascii=False)
+        os.replace(temp_path, self._path)
@@ -0,0 +1,183 @@
+"""
+Logging that stays off the event loop: callers only put records on a queue, and a background thread formats them and
+writes them to a rotating file.
+"""
+
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+DEFAULT_PATH = os.path.join("data", "bot.log")
+FORMAT = "%(asctime)s:%(levelname)s:%(name)s: %(message)s"
+
+# Comma separated logger=LEVEL pairs; a bare LEVEL is for every logger not named, e.g. "WARNING,discord.gateway=DEBUG"
+LEVELS = os.environ.get("LOG_LEVELS", "WARNING,discord=INFO")
+MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", 5 * 1024 * 1024))  # A new file is started past this size
+MAX_AGE = int(os.environ.get("LOG_MAX_AGE", 24 * 60 * 60))  # or after this many seconds; 0 for no limit
+BACKUPS = int(os.environ.get("LOG_BACKUPS", 5))  # Old files kept, as bot.log.1 (newest) to bot.log.<BACKUPS>
+
+# Each line of code gets to log this many DEBUG records per window; more are dropped and counted
+REPEAT_BURST = int(os.environ.get("LOG_REPEAT_BURST", 20))
+REPEAT_WINDOW = float(os.environ.get("LOG_REPEAT_WINDOW", 10))
+
+_listener = None
+_queue_handler = None
+
+
+def parse_levels(text):
+    """
+    :param text: Str ; e.g. "WARNING,discord=INFO"
+    :return: Dict in form {logger name: level Int} ; the root logger's name is ""
+    """
+
+    levels = {}
+    for part in text.split(","):
+        if part.strip():
+            name, _, level = part.rpartition("=")
+            number = logging.getLevelName(level.strip().upper())
+            if not isinstance(number, int):
+                raise ValueError("Unknown log level {level!r} in {text!r}".format(level=level, text=text))
+            levels[name.strip()] = number
+    return levels
+
+
+class RepeatFilter(logging.Filter):
+    """
+    Drops records at or below a level once the line of code logging them has used up its burst for the current window.
+    The first record let through after some were dropped says how many.
+    """
+
+    def __init__(self, burst=REPEAT_BURST, window=REPEAT_WINDOW, level=logging.DEBUG):
+        """
+        :param burst: Int ; records let through per line of code per window
+        :param window: Number ; seconds
+        :param level: Int ; records above this level always get through
+        """
+
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.level = level
+        self.dropped = 0
+        self._sites = {}  # (path, line number): [window start, records let through, records dropped]
+
+    def filter(self, record):
+        if record.levelno > self.level:
+            return True
+
+        site = (record.pathname, record.lineno)
+        state = self._sites.get(site)
+        if state is None or record.created - state[0] >= self.window:
+            if state is not None and state[2]:
+                # Nothing here is a % placeholder, so arguments are still formatted as before
+                record.msg = "{msg} [{n} more like this dropped]".format(msg=record.msg, n=state[2])
+            self._sites[site] = [record.created, 1, 0]
+            return True
+        if state[1] < self.burst:
+            state[1] += 1
+            return True
+        state[2] += 1
+        self.dropped += 1
+        return False
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues records as they are. The stock handler formats them first, on the caller's thread; these never leave the
+    process, so the listener thread can do that.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class RotatingHandler(logging.handlers.RotatingFileHandler):
+    """
+    Starts a new file when the current one gets too big or too old, keeping a few numbered old ones.
+    """
+
+    def __init__(self, path, max_bytes=MAX_BYTES, max_age=MAX_AGE, backups=BACKUPS):
+        """
+        :param path: Str
+        :param max_bytes: Int ; 0 for no limit
+        :param max_age: Number ; seconds, 0 for no limit
+        :param backups: Int
+        """
+
+        super().__init__(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8", delay=True)
+        self.max_age = max_age
+        self._started = time.time()
+
+    def shouldRollover(self, record):
+        if self.max_age and record.created - self._started >= self.max_age:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self._started = time.time()
+
+
+def start(path=DEFAULT_PATH, levels=LEVELS):
+    """
+    Sends every logger's records to the file at path, through a queue, at the given levels. Warnings and worse also
+    go to stderr. The previous run's file is kept as the first backup rather than overwritten.
+    :param path: Str
+    :param levels: Str ; in LOG_LEVELS's form
+    :return: NoneType
+    """
+
+    global _listener, _queue_handler
+    stop()
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    file_handler = RotatingHandler(path)
+    file_handler.setFormatter(logging.Formatter(FORMAT))
+    if os.path.exists(path) and os.path.getsize(path):
+        file_handler.doRollover()
+    console_handler = logging.StreamHandler(sys.stderr)
+    console_handler.setLevel(logging.WARNING)
+    console_handler.setFormatter(logging.Formatter(FORMAT))
+
+    records = queue.Queue()
+    _queue_handler = _DeferredQueueHandler(records)
+    _queue_handler.addFilter(RepeatFilter())
+    _listener = logging.handlers.QueueListener(records, file_handler, console_handler, respect_handler_level=True)
+
+    for name, level in parse_levels(levels).items():
+        logging.getLogger(name or None).setLevel(level)
+    logging.getLogger().addHandler(_queue_handler)
+    _listener.start()
+
+
+def stats():
+    """
+    :return: Dict of numbers
+    """
+
+    if _queue_handler is None:
+        return {}
+    repeat_filter, = _queue_handler.filters
+    return {"queued": _queue_handler.queue.qsize(), "dropped repeats": repeat_filter.dropped}
+
+
+def stop():
+    """
+    Writes out whatever is still queued and closes the file. Safe to call if logging was never started.
+    :return: NoneType
+    """
+
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    logging.getLogger().removeHandler(_queue_handler)
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
+    _queue_handler = None
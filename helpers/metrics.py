@@ -0,0 +1,218 @@
+"""
+Process-wide timings, counters, and cache statistics, viewable with ?stats and exported in Prometheus text format.
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+
+DEFAULT_PATH = os.path.join("data", "metrics.prom")
+SAMPLES_KEPT = 2048  # Most recent samples per histogram that percentiles are computed from
+
+
+class Histogram:
+    """
+    Counts and sums every observation, and keeps the most recent ones for percentiles.
+    """
+
+    def __init__(self, samples_kept=SAMPLES_KEPT):
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+        self._samples = deque(maxlen=samples_kept)
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self._samples.append(value)
+
+    def percentiles(self, *quantiles):
+        """
+        :param quantiles: Floats between 0 and 1
+        :return: List of Floats, or of NoneType if nothing has been observed
+        """
+
+        ordered = sorted(self._samples)
+        if not ordered:
+            return [None for _ in quantiles]
+        return [ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in quantiles]
+
+
+command_latencies = {}  # name: Histogram of seconds
+upstream_latencies = {}  # service: Histogram of seconds
+parse_times = {}  # kind of page: Histogram of seconds of CPU time spent parsing one page
+counters = {}  # name: Int
+_caches = {}  # name: object with stats() returning at least hits and misses
+_extra_stats = {}  # name: function returning a Dict of numbers
+
+
+def _histogram(table, name):
+    if name not in table:
+        table[name] = Histogram()
+    return table[name]
+
+
+def observe_command(name, seconds, failed=False):
+    """
+    :param name: Str
+    :param seconds: Float
+    :param failed: Bool
+    :return: NoneType
+    """
+
+    histogram = _histogram(command_latencies, name)
+    histogram.observe(seconds)
+    if failed:
+        histogram.errors += 1
+
+
+def observe_parse(kind, cpu_seconds):
+    """
+    :param kind: Str ; e.g. "article"
+    :param cpu_seconds: Float
+    :return: NoneType
+    """
+    _histogram(parse_times, kind).observe(cpu_seconds)
+
+
+@contextmanager
+def timed_call(service):
+    """
+    Times a call to an outside service, counting it as an error if it raises or the function it yields is called,
+    e.g. for an error response that's returned rather than raised.
+    :param service: Str ; e.g. "wikipedia"
+    """
+
+    histogram = _histogram(upstream_latencies, service)
+    failed = False
+
+    def fail():
+        nonlocal failed
+        failed = True
+
+    start = time.perf_counter()
+    try:
+        yield fail
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        histogram.observe(time.perf_counter() - start)
+        if failed:
+            histogram.errors += 1
+
+
+def increment(name, amount=1):
+    counters[name] = counters.get(name, 0) + amount
+
+
+def register_cache(name, cache):
+    """
+    :param name: Str
+    :param cache: Object with a stats() method returning a Dict with "hits" and "misses"
+    :return: NoneType
+    """
+    _caches[name] = cache
+
+
+def register_stats(name, function):
+    """
+    :param name: Str
+    :param function: Function taking nothing and returning a flat Dict of numbers
+    :return: NoneType
+    """
+    _extra_stats[name] = function
+
+
+def cache_stats():
+    """
+    :return: Dict in form {name: stats Dict}
+    """
+    return {name: cache.stats() for name, cache in sorted(_caches.items())}
+
+
+def extra_stats():
+    """
+    :return: Dict in form {name: Dict of numbers}
+    """
+    return {name: function() for name, function in sorted(_extra_stats.items())}
+
+
+def _metric_name(text):
+    return "".join(c if c.isalnum() else "_" for c in text.lower())
+
+
+def _escape(text):
+    return str(text).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def render_prometheus():
+    """
+    :return: Str ; every metric in Prometheus text exposition format
+    """
+
+    lines = []
+    for metric, label, table in (("plasma_command_seconds", "command", command_latencies),
+                                 ("plasma_upstream_seconds", "service", upstream_latencies),
+                                 ("plasma_parse_cpu_seconds", "page", parse_times)):
+        lines.append("# TYPE {m} summary".format(m=metric))
+        errors = []
+        for name, histogram in sorted(table.items()):
+            for q, value in zip((0.5, 0.95, 0.99), histogram.percentiles(0.5, 0.95, 0.99)):
+                if value is not None:
+                    lines.append('{m}{{{l}="{n}",quantile="{q}"}} {v:.6f}'.format(
+                        m=metric, l=label, n=_escape(name), q=q, v=value))
+            lines.append('{m}_count{{{l}="{n}"}} {v}'.format(m=metric, l=label, n=_escape(name), v=histogram.count))
+            lines.append('{m}_sum{{{l}="{n}"}} {v:.6f}'.format(m=metric, l=label, n=_escape(name), v=histogram.total))
+            errors.append('{m}_errors_total{{{l}="{n}"}} {v}'.format(
+                m=metric, l=label, n=_escape(name), v=histogram.errors))
+        lines.append("# TYPE {m}_errors_total counter".format(m=metric))
+        lines.extend(errors)
+
+    for name, value in sorted(counters.items()):
+        lines.append("# TYPE plasma_{n}_total counter".format(n=_metric_name(name)))
+        lines.append("plasma_{n}_total {v}".format(n=_metric_name(name), v=value))
+
+    for name, stats in cache_stats().items():
+        for key, value in stats.items():
+            if isinstance(value, (int, float)):
+                lines.append('plasma_cache_{k}{{cache="{n}"}} {v}'.format(k=_metric_name(key), n=_escape(name), v=value))
+
+    for name, stats in extra_stats().items():
+        for key, value in stats.items():
+            lines.append('plasma_{n}_{k} {v}'.format(n=_metric_name(name), k=_metric_name(key), v=value))
+
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path=DEFAULT_PATH):
+    """
+    Writes atomically, so a scraper never reads half a file.
+    :param path: Str
+    :return: NoneType
+    """
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        file.write(render_prometheus())
+    os.replace(temp_path, path)
+
+
+async def write_periodically(path=DEFAULT_PATH, interval=60):
+    """
+    :param path: Str
+    :param interval: Number ; seconds between writes
+    :return: NoneType ; runs until cancelled
+    """
+
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            write_prometheus(path)
+        except OSError as e:
+            print("Couldn't write metrics to {path}: {e}".format(path=path, e=e))
@@ -0,0 +1,210 @@
+"""
+Outbound Discord messages, queued per channel. Each channel sends at the pace Discord allows, and whatever piles up
+meanwhile is merged into as few messages as possible, instead of every reply racing for the same rate limit.
+"""
+
+import asyncio
+import time
+import weakref
+
+import discord
+
+from helpers import cache, metrics, ratelimit
+
+MAX_CONTENT = 2000  # Characters Discord allows in one message
+MAX_CHANNELS = 1000  # Channel buckets held; idle ones are dropped first
+
+# scope: (messages/second, burst) ; Discord allows 5 messages per 5 seconds in a channel, and 50 requests a second
+# overall, which is kept well clear of since other calls (e.g. presence) share it
+LIMITS = {
+    "channel": (1, 5),
+    "global": (30, 30),
+}
+
+_outboxes = weakref.WeakKeyDictionary()  # bot: Outbox
+
+
+class _Message:
+    """
+    One message to send, standing in for every queued message merged into it.
+    """
+
+    __slots__ = ("content", "embed", "futures")
+
+    def __init__(self, content, embed, futures):
+        """
+        :param content: Str or NoneType
+        :param embed: discord.Embed or NoneType
+        :param futures: List of asyncio.Future ; one per send() call waiting on this message
+        """
+
+        self.content = content
+        self.embed = embed
+        self.futures = futures
+
+    def merge(self, other):
+        """
+        :param other: _Message ; queued after this one
+        :return: _Message, or NoneType if the two can't go out as one message in the same order
+        """
+
+        # A message has one embed, shown below its text, so text can only be added in front of it
+        if self.embed is not None:
+            return None
+        content = "\n".join(part for part in (self.content, other.content) if part)
+        if len(content) > MAX_CONTENT:
+            return None
+        return _Message(content or None, other.embed, self.futures + other.futures)
+
+
+def _is_rate_limited(error):
+    response = getattr(error, "response", None)
+    return isinstance(error, discord.HTTPException) and getattr(response, "status", None) == 429
+
+
+class Outbox:
+
+    def __init__(self, bot, limits=None, max_channels=MAX_CHANNELS):
+        """
+        :param bot: discord.ext.commands.Bot
+        :param limits: Dict in LIMITS's form, or NoneType for LIMITS
+        :param max_channels: Int
+        """
+
+        limits = limits or LIMITS
+        self._bot = bot
+        self._channel_limit = limits["channel"]
+        self._global_bucket = ratelimit.TokenBucket(*limits["global"])
+        self._channel_buckets = cache.LRUCache(max_channels)
+        self._paused_until = 0  # time.monotonic() when a global 429 from Discord is over
+        self._queues = {}  # channel ID: List of _Message waiting to be sent
+        self._workers = {}  # channel ID: Future sending that channel's queue; only while it's not empty
+        self.sent = 0
+        self.merged = 0
+        self.rate_limited = 0
+
+    def _channel_bucket(self, channel):
+        bucket = self._channel_buckets.get(channel)
+        if bucket is None:
+            bucket = ratelimit.TokenBucket(*self._channel_limit)
+            self._channel_buckets.put(channel, bucket)
+        return bucket
+
+    async def send(self, destination, content=None, embed=None):
+        """
+        Queues a message and waits until it's been sent, possibly merged with others for the same channel.
+        :param destination: discord.Channel or anything else with an id that Bot.send_message() takes
+        :param content: Str or NoneType
+        :param embed: discord.Embed or NoneType
+        :raises discord.HTTPException: if Discord wouldn't take the message
+        :return: discord.Message ; shared by every message merged into it
+        """
+
+        future = asyncio.get_event_loop().create_future()
+        channel = destination.id
+        self._queues.setdefault(channel, []).append(_Message(content, embed, [future]))
+        if channel not in self._workers:
+            self._workers[channel] = asyncio.ensure_future(self._drain(channel, destination))
+        return await future
+
+    async def _wait_turn(self, channel):
+        """
+        Waits until the channel may send again, reserving the slot so other channels queue behind it.
+        :param channel: Str
+        :return: NoneType
+        """
+
+        buckets = (self._channel_bucket(channel), self._global_bucket)
+        wait = max([bucket.wait_time() for bucket in buckets] + [self._paused_until - time.monotonic()])
+        for bucket in buckets:
+            bucket.take()
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = self._paused_until - time.monotonic()  # A global 429 may have come in meanwhile
+
+    def _next_message(self, queue):
+        """
+        Takes the first queued message, merged with as many of those after it as will fit.
+        :param queue: List of _Message
+        :return: _Message
+        """
+
+        message = queue.pop(0)
+        while queue:
+            merged = message.merge(queue[0])
+            if merged is None:
+                break
+            message = merged
+            queue.pop(0)
+            self.merged += 1
+        return message
+
+    def _should_retry(self, error):
+        """
+        :param error: Exception
+        :return: Bool or Number ; see ratelimit.with_backoff()
+        """
+
+        if not _is_rate_limited(error):
+            return False
+
+        # discord.py already retried, so this is a bucket it doesn't know about; wait out what Discord says
+        self.rate_limited += 1
+        retry_after = ratelimit.parse_retry_after(error.response.headers)
+        if retry_after and error.response.headers.get("X-RateLimit-Global"):
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+        return retry_after or True
+
+    async def _drain(self, channel, destination):
+        """
+        Sends a channel's queue until it's empty.
+        :param channel: Str
+        :param destination: Whatever send() was given
+        :return: NoneType
+        """
+
+        queue = self._queues[channel]
+        try:
+            while queue:
+                await self._wait_turn(channel)
+                message = self._next_message(queue)
+                try:
+                    result = await ratelimit.with_backoff(
+                        lambda: self._bot.send_message(destination, message.content, embed=message.embed),
+                        self._should_retry)
+                except Exception as e:
+                    for future in message.futures:
+                        if not future.done():
+                            future.set_exception(e)
+                else:
+                    self.sent += 1
+                    for future in message.futures:
+                        if not future.done():
+                            future.set_result(result)
+        finally:
+            for message in queue:
+                for future in message.futures:
+                    future.cancel()
+            del self._queues[channel]
+            del self._workers[channel]
+
+    def stats(self):
+        """
+        :return: Dict of numbers
+        """
+        return {"sent": self.sent, "merged": self.merged, "rate limited": self.rate_limited,
+                "queued": sum(len(queue) for queue in self._queues.values())}
+
+
+def get_outbox(bot):
+    """
+    Returns the bot's outbox, creating it on first use, so every cog shares the same queues and limits.
+    :param bot: discord.ext.commands.Bot
+    :return: Outbox
+    """
+
+    outbox = _outboxes.get(bot)
+    if outbox is None:
+        outbox = _outboxes[bot] = Outbox(bot)
+        metrics.register_stats("outbox", outbox.stats)
+    return outbox
@@ -0,0 +1,119 @@
+"""
+Worker processes for parsing HTML, so big pages never hold up the event loop, and with it Discord's heartbeats.
+Workers send back plain tuples rather than soups, which are slow to pickle and only needed while parsing.
+"""
+
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from helpers import metrics, wiki
+
+# Worker processes; 0 parses in a thread of this process instead, which still contends with the event loop for the GIL
+POOL_SIZE = int(os.environ.get("PARSE_POOL_SIZE", max(1, (os.cpu_count() or 1) - 1)))
+
+_cpu_time = getattr(time, "thread_time", time.process_time)  # thread_time is newer, and exact in threads too
+_pool = None
+
+
+def _timed(function, *args):
+    """
+    Runs in a worker.
+    :return: Tuple in form (whatever function returns, seconds of CPU time it took)
+    """
+
+    start = _cpu_time()
+    result = function(*args)
+    return result, _cpu_time() - start
+
+
+def _article_record(title, html):
+    """
+    Runs in a worker.
+    :param title: Str
+    :param html: Str
+    :return: Tuple in form (title, url, paragraphs, image url) ; paragraphs is a Tuple of Str
+    """
+
+    article = wiki.Article.from_html(title, html)
+    return article.title, article.url, tuple(article.paragraphs), article.image_url
+
+
+def get_pool():
+    """
+    Returns the shared pool, starting it on first use.
+    :return: ProcessPoolExecutor
+    """
+
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=POOL_SIZE)
+    return _pool
+
+
+def start():
+    """
+    Starts every worker now, e.g. before logging or Discord open files and sockets that forked workers would otherwise
+    inherit. Does nothing if parsing is done in threads.
+    :return: NoneType
+    """
+
+    if POOL_SIZE:
+        pool = get_pool()
+        # Workers are only started for submitted work, so give each one something
+        for future in [pool.submit(os.getpid) for _ in range(POOL_SIZE)]:
+            future.result()
+
+
+async def _run(kind, function, *args):
+    """
+    :param kind: Str ; what's being parsed, for metrics, e.g. "article"
+    :param function: Module-level function, so it can be sent to a worker
+    :return: Whatever function returns
+    """
+
+    loop = asyncio.get_event_loop()
+    try:
+        result, cpu_seconds = await loop.run_in_executor(get_pool() if POOL_SIZE else None, _timed, function, *args)
+    except BrokenProcessPool:
+        # A worker died, e.g. killed for memory; start a new pool and try once more
+        shutdown()
+        result, cpu_seconds = await loop.run_in_executor(get_pool(), _timed, function, *args)
+    metrics.observe_parse(kind, cpu_seconds)
+    return result
+
+
+async def parse_table(html, class_name="wikitable"):
+    """
+    wiki.get_table_rows() in a worker.
+    :param html: Str
+    :param class_name: Str
+    :return: List of tuples in form (cells, link)
+    """
+    return await _run("list table", wiki.get_table_rows, html, class_name)
+
+
+async def parse_article(title, html):
+    """
+    wiki.Article.from_html() in a worker.
+    :param title: Str
+    :param html: Str
+    :return: wiki.Article
+    """
+
+    title, url, paragraphs, image_url = await _run("article", _article_record, title, html)
+    return wiki.Article(title, url, list(paragraphs), image_url)
+
+
+def shutdown():
+    """
+    Stops the workers. Safe to call if the pool was never started.
+    :return: NoneType
+    """
+
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False)
+    _pool = None
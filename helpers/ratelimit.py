@@ -0,0 +1,179 @@
+"""
+Token-bucket rate limiting and retry backoff for every outbound API, so bursts queue up instead of getting 429s.
+"""
+
+import asyncio
+import random
+import time
+
+from helpers import cache
+
+BUSY_REPLY = "I'm a bit overloaded right now. Try again in a few seconds."
+DEFAULT_DEADLINE = 5  # Seconds a caller is willing to queue before getting Busy
+
+# service: (requests/second, burst, per-guild requests/second, per-guild burst)
+SERVICES = {
+    "wikipedia": (10, 20, 2, 6),
+    "reddit": (1, 5, 0.25, 3),
+    "google": (10, 20, 1, 5),
+}
+
+
+class Busy(Exception):
+
+    def __init__(self, service, wait):
+        super().__init__("{service} is rate limited for another {wait:.1f}s".format(service=service, wait=wait))
+        self.service = service
+        self.wait = wait
+
+
+class TokenBucket:
+
+    def __init__(self, rate, capacity):
+        """
+        :param rate: Number ; tokens added per second
+        :param capacity: Number ; most tokens held, i.e. the largest burst
+        """
+
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self):
+        """
+        :return: Number ; seconds until a token taken now would be covered, counting everyone queued ahead
+        """
+
+        self._refill()
+        return max(0.0, (1 - self._tokens) / self.rate)
+
+    def take(self):
+        """
+        Takes a token, possibly going into debt; callers must wait out wait_time() first.
+        :return: NoneType
+        """
+
+        self._refill()
+        self._tokens -= 1
+
+
+class Limiter:
+    """
+    A global bucket per service, plus a bucket per guild and service so one busy server can't use up the quota.
+    Waiting callers queue in arrival order, since each reservation puts the bucket further into debt.
+    """
+
+    def __init__(self, services=SERVICES, max_guilds=1000):
+        """
+        :param services: Dict in form {service: (rate, burst, guild rate, guild burst)}
+        :param max_guilds: Int ; guild buckets held per service; idle ones are dropped first
+        """
+
+        self._services = services
+        self._buckets = {service: TokenBucket(rate, burst) for service, (rate, burst, _, _) in services.items()}
+        self._guild_buckets = {service: cache.LRUCache(max_guilds) for service in services}
+        self.throttled = {service: 0 for service in services}
+        self.rejected = {service: 0 for service in services}
+
+    def _guild_bucket(self, service, guild):
+        buckets = self._guild_buckets[service]
+        bucket = buckets.get(guild)
+        if bucket is None:
+            _, _, rate, burst = self._services[service]
+            bucket = TokenBucket(rate, burst)
+            buckets.put(guild, bucket)
+        return bucket
+
+    async def _acquire(self, service, buckets, deadline):
+        """
+        :param service: Str
+        :param buckets: List of TokenBucket
+        :param deadline: Number ; seconds
+        :return: NoneType
+        """
+
+        wait = max(bucket.wait_time() for bucket in buckets)
+        if wait > deadline:
+            self.rejected[service] += 1
+            raise Busy(service, wait)
+        for bucket in buckets:
+            bucket.take()
+        if wait > 0:
+            self.throttled[service] += 1
+            await asyncio.sleep(wait)
+
+    async def acquire(self, service, deadline=DEFAULT_DEADLINE):
+        """
+        Wait for permission to make one call to a service.
+        :param service: Str
+        :param deadline: Number ; seconds
+        :raises Busy: if the wait would be longer than the deadline
+        :return: NoneType
+        """
+        await self._acquire(service, [self._buckets[service]], deadline)
+
+    async def admit(self, service, guild, deadline=DEFAULT_DEADLINE):
+        """
+        Wait for permission for a guild's command to use a service; the calls it then makes still acquire().
+        :param service: Str
+        :param guild: Hashable or NoneType ; NoneType (e.g. direct messages) shares one bucket
+        :param deadline: Number ; seconds
+        :raises Busy: if the wait would be longer than the deadline
+        :return: NoneType
+        """
+        await self._acquire(service, [self._guild_bucket(service, guild)], deadline)
+
+
+limiter = Limiter()
+
+
+async def with_backoff(call, should_retry, attempts=4, base_delay=0.5, max_delay=8):
+    """
+    Awaits call(), retrying with jittered exponential backoff when it fails in a way should_retry() allows.
+    :param call: Function taking nothing and returning an awaitable
+    :param should_retry: Function taking the exception and returning a Bool, or a Number of seconds to wait
+        (e.g. from a Retry-After header)
+    :param attempts: Int
+    :param base_delay: Number ; seconds before the first retry
+    :param max_delay: Number ; seconds
+    :return: Whatever call() results in
+    """
+
+    for attempt in range(attempts):
+        try:
+            return await call()
+        except Exception as e:
+            verdict = should_retry(e)
+            if not verdict or attempt == attempts - 1:
+                raise
+            if verdict is True:
+                delay = min(max_delay, base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+            else:
+                delay = min(max_delay, verdict)
+            await asyncio.sleep(delay)
+
+
+def parse_retry_after(headers):
+    """
+    :param headers: Mapping
+    :return: Number or NoneType ; only the delay-seconds form is understood
+    """
+
+    try:
+        return float(headers.get("Retry-After", ""))
+    except ValueError:
+        return None
+
+
+def is_retryable_status(status):
+    """
+    :param status: Int ; HTTP status code
+    :return: Bool
+    """
+    return status == 429 or status >= 500
@@ -0,0 +1,145 @@
+"""
+Constant-time random sampling structures.
+"""
+
+import random
+
+from helpers import cache
+
+
+class AliasTable:
+    """
+    Walker/Vose alias table: draws an index with probability proportional to its weight in O(1).
+    """
+
+    def __init__(self, weights, rng=random):
+        """
+        :param weights: List of Numbers ; at least one must be positive
+        :param rng: random.Random-like
+        """
+
+        total = float(sum(weights))
+        if total <= 0:
+            raise ValueError("At least one weight must be positive")
+
+        n = len(weights)
+        self._rng = rng
+        self._probability = [0.0] * n
+        self._alias = [0] * n
+
+        scaled = [weight * n / total for weight in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self._probability[less] = scaled[less]
+            self._alias[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            (small if scaled[more] < 1.0 else large).append(more)
+
+        # Whatever is left over is 1 up to rounding error
+        for i in small + large:
+            self._probability[i] = 1.0
+
+    def __len__(self):
+        return len(self._probability)
+
+    def draw(self):
+        """
+        :return: Int
+        """
+
+        i = self._rng.randrange(len(self._probability))
+        return i if self._rng.random() < self._probability[i] else self._alias[i]
+
+
+class ShuffleBag:
+    """
+    Draws every item of a pool once, in random order, before any repeats. Each draw is one step of a lazy
+    Fisher-Yates shuffle, so it costs O(1) and the pool is never copied.
+    """
+
+    def __init__(self, pool, rng=random):
+        """
+        :param pool: Sequence ; must not change while the bag is in use
+        :param rng: random.Random-like
+        """
+
+        self._pool = pool
+        self._rng = rng
+        self._swaps = {}
+        self._remaining = len(pool)
+
+    def draw(self):
+        """
+        :return: An item of the pool, or NoneType if the pool is empty
+        """
+
+        if not self._pool:
+            return None
+        if self._remaining == 0:
+            self._swaps.clear()
+            self._remaining = len(self._pool)
+
+        # Pick from the undrawn prefix, then move the last undrawn position into the picked one
+        i = self._rng.randrange(self._remaining)
+        last = self._remaining - 1
+        picked = self._swaps.get(i, i)
+        self._swaps[i] = self._swaps.pop(last, last)
+        self._remaining = last
+        return self._pool[picked]
+
+
+class PoolSampler:
+    """
+    Weighted choice between named pools, then no-repeat draws from the chosen pool, with a separate shuffle bag
+    for every (channel, pool). Build a new one when the pools change instead of mutating this one.
+    """
+
+    def __init__(self, pools, weights, max_bags=512, rng=random):
+        """
+        :param pools: Dict in form {key: Sequence}
+        :param weights: Dict in form {key: Number} ; pools missing or weighted 0 are never picked
+        :param max_bags: Int ; least recently used bags are dropped past this, and start over if needed again
+        :param rng: random.Random-like
+        """
+
+        self._pools = pools
+        self._keys = [key for key in pools if pools[key] and weights.get(key, 0) > 0]
+        self._table = AliasTable([weights[key] for key in self._keys], rng) if self._keys else None
+        self._bags = cache.LRUCache(max_bags)
+        self._rng = rng
+
+    @property
+    def bags(self):
+        return self._bags
+
+    def draw_weighted(self, channel=None):
+        """
+        :param channel: Hashable or NoneType ; no channel means no repeat avoidance
+        :return: An item of one of the pools, or NoneType if they're all empty
+        """
+
+        if self._table is None:
+            return None
+        key = self._keys[self._table.draw()]
+        return self.draw(key, self._pools[key], channel)
+
+    def draw(self, key, pool, channel=None):
+        """
+        :param key: Hashable ; identifies the pool, e.g. the filters that produced it
+        :param pool: Sequence
+        :param channel: Hashable or NoneType ; no channel means no repeat avoidance
+        :return: An item of the pool, or NoneType if it's empty
+        """
+
+        if not pool:
+            return None
+        if channel is None:
+            return pool[self._rng.randrange(len(pool))]
+
+        bag = self._bags.get((channel, key))
+        if bag is None:
+            bag = ShuffleBag(pool, self._rng)
+            self._bags.put((channel, key), bag)
+        return bag.draw()
@@ -0,0 +1,115 @@
+"""
+Fuzzy and prefix search over a fixed set of names, e.g. for "Did you mean...?" replies.
+"""
+
+import bisect
+import heapq
+
+
+def normalize(text):
+    """
+    :param text: Str
+    :return: Str ; lowercase, with runs of whitespace collapsed
+    """
+    return " ".join(text.lower().split())
+
+
+def trigrams(text):
+    """
+    :param text: Str ; already normalized
+    :return: Set of Str ; padded so that the start and end of words count for more
+    """
+
+    padded = "  " + text + " "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+    """
+    Trigram index for ranked near-matches plus a sorted list for prefix completions. Built once per name set.
+    """
+
+    def __init__(self, names):
+        """
+        :param names: Iterable of Str
+        """
+
+        self._names = []
+        self._sizes = []
+        self._postings = {}
+        self._exact = {}  # normalized name: name ; the first of any that normalize the same
+        for name in names:
+            key = normalize(name)
+            if not key or key in self._exact:
+                continue
+            self._exact[key] = name
+            grams = trigrams(key)
+            self._names.append(name)
+            self._sizes.append(len(grams))
+            for gram in grams:
+                self._postings.setdefault(gram, []).append(len(self._names) - 1)
+
+        self._sorted = sorted((normalize(name), name) for name in self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def find(self, query):
+        """
+        :param query: Str
+        :return: Str ; the name matching query except for case and spacing, or NoneType
+        """
+        return self._exact.get(normalize(query))
+
+    def complete(self, prefix, limit=5):
+        """
+        :param prefix: Str
+        :param limit: Int
+        :return: List of Str ; names starting with prefix, alphabetically
+        """
+
+        key = normalize(prefix)
+        if not key:
+            return []
+        results = []
+        i = bisect.bisect_left(self._sorted, (key, ""))
+        while i < len(self._sorted) and len(results) < limit and self._sorted[i][0].startswith(key):
+            results.append(self._sorted[i][1])
+            i += 1
+        return results
+
+    def similar(self, query, limit=5, threshold=0.4):
+        """
+        Ranks names by Dice similarity of their trigrams to the query's.
+        :param query: Str
+        :param limit: Int
+        :param threshold: Float ; minimum similarity, between 0 and 1
+        :return: List of Str, best match first
+        """
+
+        grams = trigrams(normalize(query))
+        shared = {}
+        for gram in grams:
+            for i in self._postings.get(gram, ()):
+                shared[i] = shared.get(i, 0) + 1
+
+        size = len(grams)
+        scored = ((2 * count / (size + self._sizes[i]), i) for i, count in shared.items())
+        best = heapq.nlargest(limit, (pair for pair in scored if pair[0] >= threshold))
+        return [self._names[i] for _, i in best]
+
+    def suggest(self, query, limit=3):
+        """
+        Prefix completions first, then near-matches, without repeats.
+        :param query: Str
+        :param limit: Int
+        :return: List of Str
+        """
+
+        results = self.complete(query, limit)
+        for name in self.similar(query, limit):
+            if len(results) >= limit:
+                break
+            if name not in results:
+                results.append(name)
+        return results
@@ -0,0 +1,116 @@
+"""
+Multi-field warship filtering, answered by intersecting inverted indexes built once from the ship table.
+"""
+
+import bisect
+import re
+
+from helpers import cache, search
+
+_WORD_PATTERN = re.compile(r"[a-z]+")
+
+
+def class_key(text):
+    """
+    :param text: Str ; e.g. "Yamato class" or "yamato"
+    :return: Str
+    """
+
+    key = search.normalize(text)
+    return key[:-len(" class")] if key.endswith(" class") else key
+
+
+class ShipQueryIndex:
+
+    def __init__(self, store, result_cache_size=128):
+        """
+        :param store: ShipStore
+        :param result_cache_size: Int ; how many distinct queries to remember the answers to
+        """
+
+        self._names = list(store.ships)
+        self._all = frozenset(range(len(self._names)))
+        self._results = cache.LRUCache(result_cache_size)
+        ids = {name: i for i, name in enumerate(self._names)}
+
+        self._by_nation = {nation: {ids[name] for name in names} for nation, names in store.ships_by_nation.items()}
+        self._by_type = {_type: {ids[name] for name in names if name in ids}
+                         for _type, names in store.ships_by_type.items()}
+        self._by_class = {}
+        self._by_fate_word = {}
+        years = []
+        tons = []
+        for i, name in enumerate(self._names):
+            ship = store.ships[name]
+            self._by_class.setdefault(class_key(ship.ship_class), set()).add(i)
+            for word in set(_WORD_PATTERN.findall(ship.fate.lower())):
+                self._by_fate_word.setdefault(word, set()).add(i)
+            if ship.year is not None:
+                years.append((ship.year, i))
+            if ship.tons is not None:
+                tons.append((ship.tons, i))
+
+        # Sorted (value, id) pairs, so a range is two bisections
+        years.sort()
+        tons.sort()
+        self._years = years
+        self._tons = tons
+
+    @staticmethod
+    def _in_range(pairs, low, high):
+        """
+        :param pairs: Sorted List of (Int, Int) tuples
+        :param low: Int or NoneType
+        :param high: Int or NoneType
+        :return: Set of Int
+        """
+
+        start = 0 if low is None else bisect.bisect_left(pairs, (low, -1))
+        end = len(pairs) if high is None else bisect.bisect_right(pairs, (high, float("inf")))
+        return {i for _, i in pairs[start:end]}
+
+    def query(self, nation=None, _type=None, _class=None, fate=None, years=None, tons=None):
+        """
+        Get every ship matching all given filters; NoneType filters are ignored.
+        :param nation: Str
+        :param _type: Str ; list page category, e.g. "battleships"
+        :param _class: Str
+        :param fate: Str ; one or more words, all of which must be in the fate, e.g. "sunk" or "sunk by aircraft"
+        :param years: Tuple in form (low, high) of commission years; either can be NoneType
+        :param tons: Tuple in form (low, high) of displacements; either can be NoneType
+        :return: Tuple of Str ; ship names, indexable for O(1) random choice
+        """
+
+        key = (nation, _type, _class and class_key(_class), fate and fate.lower(), years, tons)
+        result = self._results.get(key)
+        if result is not None:
+            return result
+
+        sets = []
+        if nation is not None:
+            sets.append(self._by_nation.get(nation, set()))
+        if _type is not None:
+            sets.append(self._by_type.get(_type, set()))
+        if _class is not None:
+            sets.append(self._by_class.get(class_key(_class), set()))
+        if fate is not None:
+            words = _WORD_PATTERN.findall(fate.lower())
+            sets.extend(self._by_fate_word.get(word, set()) for word in words)
+            if not words:
+                sets.append(set())
+        if years is not None:
+            sets.append(self._in_range(self._years, *years))
+        if tons is not None:
+            sets.append(self._in_range(self._tons, *tons))
+
+        # Intersect smallest first, so the work is bounded by the most selective filter
+        sets.sort(key=len)
+        ids = set(sets[0]) if sets else set(self._all)
+        for other in sets[1:]:
+            if not ids:
+                break
+            ids &= other
+
+        result = tuple(self._names[i] for i in sorted(ids))
+        self._results.put(key, result)
+        return result
@@ -0,0 +1,259 @@
+"""
+Versioned on-disk store of warship data, indexed by name, nation, and hull type once loaded.
+"""
+
+import json
+import os
+import pickle
+import re
+import sys
+import time
+
+VERSION = 1
+DEFAULT_PATH = os.path.join("data", "ships.json")
+LEGACY_PICKLE_PATH = os.path.join("data", "cache.pkl")
+MINOR_NATION = "minor"
+
+_YEAR_PATTERN = re.compile(r"\b(1[89]\d\d)\b")
+_NUMBER_PATTERN = re.compile(r"\d[\d,]*")
+
+
+def parse_year(text):
+    """
+    :param text: Str ; e.g. "15 March 1940"
+    :return: Int or NoneType
+    """
+
+    match = _YEAR_PATTERN.search(text)
+    return int(match.group(1)) if match else None
+
+
+def parse_tons(text):
+    """
+    :param text: Str ; e.g. "45,000 tons"; ranges give their first number
+    :return: Int or NoneType
+    """
+
+    match = _NUMBER_PATTERN.search(text)
+    return int(match.group(0).replace(",", "")) if match else None
+
+
+class Ship:
+    """
+    One hull. Slots keep thousands of these small, categorical strings are interned so every ship of a navy shares
+    one copy, and numbers are parsed once here rather than on every filter.
+    """
+
+    __slots__ = ("name", "ship_class", "country", "ship_type", "commissioned", "year", "tons", "_displacement_text",
+                 "fate", "link_title")
+
+    def __init__(self, name, ship_class, country, ship_type, commissioned, displacement, fate, link_title):
+        """
+        :param name: Str
+        :param ship_class: Str
+        :param country: Str
+        :param ship_type: Str
+        :param commissioned: Str ; as written on Wikipedia, e.g. "15 March 1940"
+        :param displacement: Str ; e.g. "45,000 tons"
+        :param fate: Str
+        :param link_title: Str or NoneType ; title of the ship's Wikipedia article
+        """
+
+        self.name = name
+        self.ship_class = sys.intern(ship_class)
+        self.country = sys.intern(country)
+        self.ship_type = sys.intern(ship_type)
+        self.commissioned = commissioned
+        self.year = parse_year(commissioned)
+        self.tons = parse_tons(displacement)
+        self.fate = sys.intern(fate)
+        self.link_title = link_title
+
+        # Only keep the text if it can't be rebuilt from the number
+        self._displacement_text = None if displacement == self._format_tons(self.tons) else displacement
+
+    @staticmethod
+    def _format_tons(tons):
+        return "{:,} tons".format(tons) if tons is not None else ""
+
+    @property
+    def displacement(self):
+        """
+        :return: Str ; e.g. "45,000 tons"
+        """
+        return self._displacement_text if self._displacement_text is not None else self._format_tons(self.tons)
+
+    def to_dict(self):
+        """
+        :return: Dict ; the on-disk form
+        """
+
+        return {"class": self.ship_class, "country": self.country, "type": self.ship_type,
+                "commissioned": self.commissioned, "displacement": self.displacement, "fate": self.fate,
+                "link title": self.link_title}
+
+    @classmethod
+    def from_dict(cls, name, data):
+        """
+        :param name: Str
+        :param data: Dict ; the on-disk form
+        :return: Ship
+        """
+
+        return cls(name, data["class"], data["country"], data["type"], data["commissioned"], data["displacement"],
+                   data["fate"], data["link title"])
+
+
+class ShipStore:
+
+    def __init__(self, ships, ships_by_type, major_nations, revisions=None):
+        """
+        :param ships: Dict in form {name: Ship}
+        :param ships_by_type: Dict in form {type:[ship]} ; types are the list page categories, e.g. "battleships"
+        :param major_nations: Iterable of Str ; every other country is indexed as "minor"
+        :param revisions: Dict in form {type: revision ID of its list page}
+        """
+
+        self.ships = ships
+        self.ships_by_type = ships_by_type
+        self.revisions = revisions or {}
+        self.ships_by_nation = {nation: [] for nation in major_nations}
+        self.ships_by_nation.setdefault(MINOR_NATION, [])
+        for name, ship in ships.items():
+            self.ships_by_nation[self._nation_of(ship)].append(name)
+
+    def copy(self):
+        """
+        :return: ShipStore ; changing it leaves this one untouched. Ships are shared; they're replaced, not modified
+        """
+        return ShipStore(dict(self.ships), {_type: list(names) for _type, names in self.ships_by_type.items()},
+                         list(self.ships_by_nation), dict(self.revisions))
+
+    def _nation_of(self, ship):
+        return ship.country if ship.country in self.ships_by_nation else MINOR_NATION
+
+    def __len__(self):
+        return len(self.ships)
+
+    def get(self, name):
+        """
+        :param name: Str
+        :return: Ship or NoneType
+        """
+        return self.ships.get(name)
+
+    def names_of_nation(self, nation):
+        """
+        :param nation: Str
+        :return: List of Str
+        """
+        return self.ships_by_nation.get(nation, [])
+
+    def names_of_type(self, _type):
+        """
+        :param _type: Str
+        :return: List of Str
+        """
+        return self.ships_by_type.get(_type, [])
+
+    def replace_type(self, _type, ships_of_type, revision):
+        """
+        Swaps in a freshly scrapped list page, touching only the ships that were or are on it.
+        :param _type: Str
+        :param ships_of_type: Dict in form {name: Ship}
+        :param revision: Int or NoneType ; revision ID of the page that was scrapped
+        :return: NoneType
+        """
+
+        # Ships listed under another type too are kept
+        elsewhere = set()
+        for other_type, names in self.ships_by_type.items():
+            if other_type != _type:
+                elsewhere.update(names)
+
+        # Unindex ships that are gone or may have changed nations
+        stale = {name for name in self.ships_by_type.get(_type, []) if name in self.ships}
+        stale.update(name for name in ships_of_type if name in self.ships)
+        stale_by_nation = {}
+        for name in stale:
+            stale_by_nation.setdefault(self._nation_of(self.ships[name]), set()).add(name)
+        for nation, names in stale_by_nation.items():
+            self.ships_by_nation[nation] = [name for name in self.ships_by_nation[nation] if name not in names]
+        for name in stale - elsewhere:
+            del self.ships[name]
+
+        # Index new versions, including stale ships that were only unindexed
+        for name in stale & elsewhere:
+            if name not in ships_of_type:
+                self.ships_by_nation[self._nation_of(self.ships[name])].append(name)
+        for name, ship in ships_of_type.items():
+            self.ships[name] = ship
+            self.ships_by_nation[self._nation_of(ship)].append(name)
+
+        self.ships_by_type[_type] = list(ships_of_type)
+        self.revisions[_type] = revision
+
+    def save(self, path=DEFAULT_PATH):
+        """
+        Writes the store atomically, so a crash mid-write never leaves a broken file behind.
+        :param path: Str
+        :return: NoneType
+        """
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        ships = {name: ship.to_dict() for name, ship in self.ships.items()}
+        data = {"version": VERSION, "ships": ships, "types": self.ships_by_type, "revisions": self.revisions}
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(data, file, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, major_nations, path=DEFAULT_PATH):
+        """
+        Reads the store, migrating the old pickle cache if that's all there is.
+        :param major_nations: Iterable of Str
+        :param path: Str
+        :return: ShipStore, or NoneType if there's no usable data on disk
+        """
+
+        start = time.perf_counter()
+        try:
+            with open(path, encoding="utf-8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return cls._migrate_pickle(major_nations, path)
+        except ValueError:
+            print("Ship store at {path} is corrupt; ignoring it.".format(path=path))
+            return None
+
+        if data.get("version") != VERSION:
+            print("Ship store at {path} is an old version; ignoring it.".format(path=path))
+            return None
+
+        ships = {name: Ship.from_dict(name, ship) for name, ship in data["ships"].items()}
+        store = cls(ships, data["types"], major_nations, data.get("revisions"))
+        print("Loaded {n} ships in {ms:.1f} ms.".format(n=len(store), ms=(time.perf_counter() - start) * 1000))
+        return store
+
+    @classmethod
+    def _migrate_pickle(cls, major_nations, path):
+        """
+        :param major_nations: Iterable of Str
+        :param path: Str ; where to save the migrated store
+        :return: ShipStore or NoneType
+        """
+
+        try:
+            with open(LEGACY_PICKLE_PATH, "rb") as file:
+                data = pickle.load(file)
+        except FileNotFoundError:
+            return None
+
+        ships = {name: Ship.from_dict(name, ship) for name, ship in data["ships"].items()}
+        store = cls(ships, data["types"], major_nations)
+        store.save(path)
+        print("Migrated {n} ships from {old} to {new}.".format(n=len(store), old=LEGACY_PICKLE_PATH, new=path))
+        return store
@@ -0,0 +1,47 @@
+"""
+Single-flight deduplication: concurrent lookups of the same key share one call instead of each making their own.
+"""
+
+import asyncio
+
+
+class SingleFlight:
+
+    def __init__(self):
+        self._in_flight = {}
+        self.calls = {}  # namespace: calls actually made
+        self.coalesced = {}  # namespace: lookups that joined a call already in flight
+
+    async def do(self, key, call):
+        """
+        Awaits call(), unless a call for the same key is already in flight, in which case its result is shared.
+        :param key: Tuple whose first item is a namespace for the stats, e.g. ("wikipedia", title)
+        :param call: Function taking nothing and returning an awaitable
+        :return: Whatever call() results in
+        """
+
+        namespace = key[0]
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced[namespace] = self.coalesced.get(namespace, 0) + 1
+        else:
+            self.calls[namespace] = self.calls.get(namespace, 0) + 1
+            future = asyncio.ensure_future(call())
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+
+        # A waiter giving up mustn't cancel the call for everyone else
+        return await asyncio.shield(future)
+
+    def stats(self):
+        """
+        :return: Dict in form {namespace: {"calls": Int, "coalesced": Int}}
+        """
+
+        namespaces = set(self.calls) | set(self.coalesced)
+        return {namespace: {"calls": self.calls.get(namespace, 0), "coalesced": self.coalesced.get(namespace, 0)}
+                for namespace in sorted(namespaces)}
+
+
+# Shared by every cog, so e.g. two servers asking for the same article at once share one download
+group = SingleFlight()
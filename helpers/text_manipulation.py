@@ -2,6 +2,25 @@
 Functions that modify strings for specific uses.
 """
 
+import unicodedata
+
+
+class _AccentTable(dict):
+    """
+    Translation table for str.translate() that works out each character's replacement the first time it's seen.
+    """
+
+    def __missing__(self, ordinal):
+        # Decompose, then drop the combining marks; stolen from https://stackoverflow.com/a/39612904
+        char = chr(ordinal)
+        stripped = "".join(c for c in unicodedata.normalize("NFD", char) if unicodedata.category(c) != "Mn")
+        self[ordinal] = stripped
+        return stripped
+
+
+# Still not enough to remove \u00a0, so manual it is
+_accents = _AccentTable({ord("\u00a0"): None})
+
 
 def text_generator(text):
     """
@@ -21,3 +40,13 @@ def codeblock(text):
     :return: Str
     """
     return "```\n" + text + "\n```"
+
+
+def strip_accents(text):
+    """
+    Removes accents and non-breaking spaces, e.g. "Armada Espanola" from "\u00a0Armada Española".
+    Todo: Observed: \u0142 (lowercase L with slash) not resolved
+    :param text: Str
+    :return: Str
+    """
+    return text.translate(_accents)
@@ -2,50 +2,254 @@
 Generalized functions for scrapping Wikipedia.
 """
 
-from bs4 import BeautifulSoup
-from urllib.parse import quote
-from urllib.request import urlopen
+import json
+from html.parser import HTMLParser
+from urllib.parse import quote, urlencode
+
+from helpers import fetch
 
 WIKI_ROOT = "https://en.wikipedia.org/wiki/"
+API_ROOT = "https://en.wikipedia.org/w/api.php"
+FEED_SIZE = 64 * 1024  # Characters handed to the table parser at a time, so it can stop once the table ends
+
+
+class Article:
+    """
+    A Wikipedia article that has been downloaded and parsed once, keeping only what commands need.
+    """
+
+    def __init__(self, title, url, paragraphs, image_url):
+        self.title = title
+        self.url = url
+        self.paragraphs = paragraphs
+        self.image_url = image_url
+
+    @property
+    def summary(self):
+        return "\n".join(self.paragraphs)
+
+    @classmethod
+    def from_html(cls, title, html):
+        """
+        :param title: Str
+        :param html: Str
+        :return: Article
+        """
+
+        from bs4 import BeautifulSoup  # Slow to import, and only needed once an article is fetched
+        soup = BeautifulSoup(html, "html.parser")
+        return cls(title, _find_canonical_url(soup, title), _find_lead_paragraphs(soup), _find_infobox_image(soup))
 
 
-def get_article_summary(title):
+def get_article_url(title):
+    """
+    :param title: Str
+    :return: Str
+    """
+    return WIKI_ROOT + quote(title.replace(" ", "_"))  # Quote fixes unicode errors
+
+
+async def get_article(title):
+    """
+    Downloads and parses an article in one go.
+    :param title: Str
+    :return: Article
+    """
+
+    from helpers import parse_pool  # Here, as it imports this module
+
+    data = await fetch.fetch_text(get_article_url(title))
+    return await parse_pool.parse_article(title, data)
+
+
+async def get_revision_ids(titles):
+    """
+    Looks up the latest revision of several articles in one API call, following redirects.
+    :param titles: List of Str ; at most 50, the API's limit
+    :return: Dict in form {title: revision ID}, where the ID is NoneType if the article doesn't exist
+    """
+
+    query = urlencode({"action": "query", "prop": "info", "redirects": 1, "format": "json",
+                       "formatversion": 2, "titles": "|".join(titles)})
+    data = json.loads(await fetch.fetch_text(API_ROOT + "?" + query))["query"]
+
+    # Map each requested title to the title the API finally resolved it to
+    renames = {}
+    for entry in data.get("normalized", []) + data.get("redirects", []):
+        renames[entry["from"]] = entry["to"]
+    revisions = {page["title"]: page.get("lastrevid") for page in data.get("pages", [])}
+
+    result = {}
+    for title in titles:
+        resolved = title
+        while resolved in renames:
+            resolved = renames[resolved]
+        result[title] = revisions.get(resolved)
+    return result
+
+
+async def get_article_summary(title):
     """
     Manually scraps summaries, as wikipedia.py sometimes fails lookup of pages with hyphens in title.
     :param title: Str
     :return: Str
     """
 
-    url = WIKI_ROOT + quote(title.replace(" ", "_"))  # Quote fixes unicode errors
-    data = urlopen(url)
-    soup = BeautifulSoup(data, "html.parser")
-    return soup.body.p.get_text() + " [m]"
+    article = await get_article(title)
+    return article.summary
 
 
-def get_article_first_image(title):
+async def get_article_first_image(title):
     """
     Manually get first image of page.
     :param title: Str
     :return: Str
     """
 
+    article = await get_article(title)
+    return article.image_url
+
+
+def get_table_rows(html, class_name="wikitable"):
+    """
+    Reads the first table of a class straight off the page, without building a soup for the rest of it.
+    :param html: Str
+    :param class_name: Str
+    :return: List of tuples in form (cells, link), one per row with td cells, where cells is a Tuple of each td's
+        text and link is a Tuple in form (href, title) of the first link in the first td, or NoneType
+    """
+
+    parser = _TableParser(class_name)
+    for start in range(0, len(html), FEED_SIZE):
+        parser.feed(html[start:start + FEED_SIZE])
+        if parser.done:
+            break
+    parser.close()
+    return parser.rows
+
+
+class _TableParser(HTMLParser):
+    """
+    Collects cell text the way Tag.get_text() would, for one table; tables nested in it only add text to the cell.
+    """
+
+    def __init__(self, class_name):
+        super().__init__()
+        self._class_name = class_name
+        self._depth = 0  # Tables open, counting the target, once it's been found
+        self._row = None
+        self._cell = None
+        self._link = None
+        self.rows = []
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        if tag == "table":
+            if self._depth:
+                self._depth += 1
+            elif self._class_name in (dict(attrs).get("class") or "").split():
+                self._depth = 1
+        elif self._depth == 1 and tag == "tr":
+            self._end_row()
+            self._row = []
+        elif self._depth == 1 and tag in ("td", "th") and self._row is not None:
+            # Only td cells are kept; headers are skipped, as are rows that have nothing else
+            self._end_cell()
+            self._cell = [] if tag == "td" else None
+        elif tag == "a" and self._cell is not None and not self._row and self._link is None:
+            attrs = dict(attrs)
+            self._link = (attrs.get("href"), attrs.get("title"))
+
+    def handle_endtag(self, tag):
+        if not self._depth or self.done:
+            return
+        if tag == "table":
+            self._depth -= 1
+            if not self._depth:
+                self._end_row()
+                self.done = True
+        elif self._depth == 1 and tag in ("td", "th"):
+            self._end_cell()
+        elif self._depth == 1 and tag == "tr":
+            self._end_row()
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+
+    def _end_cell(self):
+        if self._cell is not None:
+            self._row.append("".join(self._cell))
+            self._cell = None
+
+    def _end_row(self):
+        self._end_cell()
+        if self._row:
+            self.rows.append((tuple(self._row), self._link))
+        self._row = None
+        self._link = None
+
+
+def _find_canonical_url(soup, title):
+    """
+    :param soup: BeautifulSoup
+    :param title: Str ; used if the page doesn't declare a canonical URL
+    :return: Str
+    """
+
+    link = soup.find("link", rel="canonical")
+    if link and link.get("href"):
+        return link["href"]
+    return get_article_url(title)
+
+
+def _find_lead_paragraphs(soup):
+    """
+    Get the text of every paragraph before the first section heading, like wikipedia.py's summary.
+    :param soup: BeautifulSoup
+    :return: List of Str
+    """
+
+    content = soup.find("div", "mw-parser-output")
+    if content is None:
+        # Unexpected layout; fall back to the first paragraph of the page
+        return [soup.body.p.get_text().strip()] if soup.body and soup.body.p else []
+
+    # Citation markers (e.g. [1]) aren't wanted in plain text
+    for reference in content.find_all("sup", "reference"):
+        reference.decompose()
+
+    paragraphs = []
+    for element in content.find_all(["p", "h2", "div"], recursive=False):
+        # Newer skins wrap headings in <div class="mw-heading">
+        if element.name == "h2" or (element.name == "div" and "mw-heading" in element.get("class", [])):
+            break
+        if element.name == "p":
+            text = element.get_text().strip()
+            if text:
+                paragraphs.append(text)
+
+    return paragraphs
+
+
+def _find_infobox_image(soup):
+    """
+    :param soup: BeautifulSoup
+    :return: Str
+    """
+
     try:
-        url = WIKI_ROOT + quote(title.replace(" ", "_"))  # Quote fixes unicode errors
-        data = urlopen(url)
-        soup = BeautifulSoup(data, "html.parser")
         img = soup.find("table", "infobox").find("img")
 
     # If infobox doesn't exist
     except AttributeError:
         img_url = ""
 
-    # I saw an encoding error of sorts *once*, and haven't been able to reproduce it
-    except Exception as e:
-        img_url = "\n\n```Unexpected error occurred while trying to load image.\n{e}```".format(e=e)
-
     else:
-        # Assume all important images (e.g. not logos) have alt attributes
-        if img["alt"] != "":
+        # Assume all important images (e.g. not logos) have alt attributes; some lazy-loaded ones have no src
+        if img and img.get("alt", "") != "" and img.get("src"):
             partial_img_url = img.get("src")
             a = partial_img_url.split("/")
 
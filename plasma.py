@@ -1,20 +1,33 @@
-import logging
+import time
+
+STARTED = time.perf_counter()  # Startup is timed from here, so it counts the imports below
 
 import discord
 from discord.ext import commands
 import os
+import sys
+import traceback
+
+from commands import basic, warship, website, google, stats
+from helpers import logs, metrics, parse_pool
 
-from commands import basic, warship, website, google
+METRICS_INTERVAL = int(os.environ.get("METRICS_INTERVAL", 60))  # Seconds between writes of data/metrics.prom
 
 
 def main():
 
-    # Initialize
+    # Initialize; workers are forked before anything is opened, so they don't hold on to it
+    parse_pool.start()
     set_logging()
     description = "A generator bot."
     prefix = "?"
     bot = commands.Bot(command_prefix=prefix, description=description)
     playing_message = 'on {delimiter}help'.format(delimiter=prefix)
+    command_starts = {}  # id of context: time the command was invoked
+    background_tasks = []
+    startup = {}  # Seconds from STARTED until each milestone
+    metrics.register_stats("startup", lambda: {milestone: round(s, 2) for milestone, s in startup.items()})
+    metrics.register_stats("logging", logs.stats)
 
     @bot.event
     async def on_ready():
@@ -24,26 +37,56 @@ def main():
         print("---")
         await bot.change_presence(game=discord.Game(name=playing_message))
 
+        # on_ready fires again after reconnects
+        if not background_tasks:
+            startup["ready seconds"] = time.perf_counter() - STARTED
+            print("Ready {s:.2f} s after starting.".format(s=startup["ready seconds"]))
+            background_tasks.append(bot.loop.create_task(metrics.write_periodically(interval=METRICS_INTERVAL)))
+
+    @bot.event
+    async def on_command(command, context):
+        command_starts[id(context)] = time.perf_counter()
+
+    @bot.event
+    async def on_command_completion(command, context):
+        start = command_starts.pop(id(context), None)
+        if start is not None:
+            metrics.observe_command(command.name, time.perf_counter() - start)
+        startup.setdefault("first reply seconds", time.perf_counter() - STARTED)
+
+    @bot.event
+    async def on_command_error(error, context):
+        start = command_starts.pop(id(context), None)
+        if start is not None and context.command is not None:
+            metrics.observe_command(context.command.name, time.perf_counter() - start, failed=True)
+        metrics.increment("command errors")
+
+        # Replacing the default handler stops it printing tracebacks, so do what it did
+        print("Ignoring exception in command {}".format(context.command), file=sys.stderr)
+        traceback.print_exception(type(error), error, error.__traceback__, file=sys.stderr)
+
     # Remove default help
     bot.remove_command("help")
 
     # Add commands
-    categories = (basic.Basic, warship.Warship, website.Website, google.GoogleMaps)
+    categories = (basic.Basic, warship.Warship, website.Website, google.GoogleMaps, stats.Stats)
     for category in categories:
         bot.add_cog(category(bot))
 
     # Start bot
-    bot.run(os.environ["DISCORD_TOKEN"])
+    try:
+        bot.run(os.environ["DISCORD_TOKEN"])
+    finally:
+        parse_pool.shutdown()
+        logs.stop()
 
 
 def set_logging():
 
-    # Copied from the docs
-    logger = logging.getLogger("discord")
-    logger.setLevel(logging.DEBUG)
-    handler = logging.FileHandler(filename="data\\bot.log", encoding="utf-8", mode="w")
-    text = "%(asctime)s:%(levelname)s:%(name)s: %(message)s"
-    handler.setFormatter(logging.Formatter(text))
-    logger.addHandler(handler)
+    # Levels, rotation, and rate limiting are set through the LOG_* environment variables; see helpers/logs.py
+    logs.start()
+
 
-main()
+# Parse workers import this module when they're spawned rather than forked, and mustn't start a bot of their own
+if __name__ == "__main__":
+    main()